@@ -20,6 +20,16 @@ odect_settings = {
 	'api_knmi': 	str(os.environ['ODECT_API_KNMI']), 				# personal security token of KNMI 		https://developer.dataplatform.knmi.nl/get-started#obtain-an-api-key
 	'api_entsoe':	str(os.environ['ODECT_API_ENTSOE']),				# personal security token of ENTSO-e 	https://transparency.entsoe.eu/content/static_content/download?path=/Static%20content/API-Token-Management.pdf
 	'n_days':		int(str(os.environ['ODECT_N_DAYS'])), 				# Default days to download data for if no range is specified
+	'n_workers':	int(str(os.environ.get('ODECT_N_WORKERS', 4))),		# Number of windows of days that are fetched concurrently
+	'n_window':		int(str(os.environ.get('ODECT_N_WINDOW', 7))),		# Maximum number of consecutive days fetched with a single request per source
+	'n_samples':	int(str(os.environ.get('ODECT_N_SAMPLES', 1000))),	# Monte Carlo samples of the emission factors for --scenarios
+	
+	'http_timeout':	int(str(os.environ.get('ODECT_HTTP_TIMEOUT', 60))),	# Seconds to wait for a connection or response before retrying
+	'http_retries':	int(str(os.environ.get('ODECT_HTTP_RETRIES', 5))),	# Number of retries on connection errors and 429/5xx responses
+	'rate_entsoe':	int(str(os.environ.get('ODECT_RATE_ENTSOE', 400))),	# Maximum ENTSO-e requests per minute (quota per security token)
+	'rate_knmi':	int(str(os.environ.get('ODECT_RATE_KNMI', 50))),		# Maximum KNMI requests per minute (quota of the API key)
+	'cache_ttl':	int(str(os.environ.get('ODECT_CACHE_TTL', 1800))),	# Seconds before a cached response about the last 48 hours is revalidated
+	'debug_csv':	str(os.environ.get('ODECT_DEBUG_CSV', 'false')).lower() == 'true',	# Write the intermediate PV and wind data to csv files in data/
 	
 	'influx_host': 	str(os.environ['ODECT_INFLUXURL']),				# InfluxDB Host, NOTE: Only Inxludb 1.x is supported at this moment
 	'influx_port': 	str(os.environ['ODECT_INFLUXPORT']),				# InfluxDB Port, default is 8086
@@ -14,241 +14,246 @@
 # limitations under the License.
 
 import pandas as pd
-import requests as rq
+import numpy as np
 import xml.etree.ElementTree as et
-import datetime as dt
+import io
+import re
+
+from lib import cache
+from lib.store import hour_index
 
 # general parameters for ENTSO-e request
-api_adress = 'https://web-api.tp.entsoe.eu/api?'
+api_adress = 'https://web-api.tp.entsoe.eu/api'
+
+# bidding zones with cross-border exchange to the Netherlands
+dom_list = ['10YGB----------A',  # Great-Britain
+            '10YBE----------2',  # Belgium
+            '10Y1001A1001A82H',  # Germany
+            '10YDK-1--------W',  # Denmark
+            '10YNO-2--------T']  # Norway
+
+# first days on which a zone code or the available zones change, a multi-day request may not span these
+period_breaks = pd.DatetimeIndex(['2018-09-30 00:00',  # new German bidding zone
+                                  '2019-09-09 00:00'], tz='UTC')  # import data from Denmark available
+de_zone_change = pd.Timestamp('2018-09-30 22:00', tz='UTC')  # windows ending before this use the former German bidding zone
+dk_import_start = pd.Timestamp('2019-09-09 22:00', tz='UTC')  # windows ending before this have no import data from Denmark
+
+# change generation codes into readable tickers
+names = {'B01': 'BIOD',
+         'B02': 'LIGN',
+         'B03': 'COAG',
+         'B04': 'CCGT',
+         'B05': 'COAL',
+         'B06': 'OILS',
+         'B07': 'SHAL',
+         'B08': 'PEAT',
+         'B09': 'GEOT',
+         'B10': 'HYPS',
+         'B11': 'HYRR',
+         'B12': 'HYRS',
+         'B13': 'TIDE',
+         'B14': 'NUCL',
+         'B15': 'OTHR',
+         'B16': 'PVUT',
+         'B17': 'WSTE',
+         'B18': 'WDOF',
+         'B19': 'WDON',
+         'B20': 'OTHE'}
+type_list = list(names.keys())
 
 
-def fetch_generation(date, zone_code, key_entsoe):
+def import_zones(date, days=1):  # bidding zones for which import data is available on date
+    zones = list(dom_list)
+    if date + pd.Timedelta(days=days) <= dk_import_start:  # no cross-border exchange data with Denmark before 10-9-2019
+        zones.remove('10YDK-1--------W')
+    return zones
+
+
+def fetch_generation(date, zone_code, key_entsoe, days=1):  # fetch generation for a window of days in one request
     sec_token = key_entsoe
     # specific parameters for data ENTSO-e request
     doc_type = 'A75'  # generation document
     proc_type = 'A16'
     bid_zone = zone_code  # ENTSO-e code of the bidding zone
 
-    date = dt.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')
-    date_initial = date
-
-    y = date.astimezone(dt.timezone.utc).strftime('%Y')
-    m = date.astimezone(dt.timezone.utc).strftime('%m')
-    d = date.astimezone(dt.timezone.utc).strftime('%d')
-	
-    date_plus1 = date + dt.timedelta(days=1)
-    y_p1 = date_plus1.astimezone(dt.timezone.utc).strftime('%Y')
-    m_p1 = date_plus1.astimezone(dt.timezone.utc).strftime('%m')
-    d_p1 = date_plus1.astimezone(dt.timezone.utc).strftime('%d')
-
-    per_start = f'{y}{m}{d}0000'
-    per_end = f'{y_p1}{m_p1}{d_p1}0000'
+    date_plus1 = date + pd.Timedelta(days=days)
+    per_start = date.strftime('%Y%m%d0000')
+    per_end = date_plus1.strftime('%Y%m%d0000')
 
     if bid_zone == '10Y1001A1001A82H':
-        if int(per_end) <= 201809302200:  # and date is earlier than 1-10-2018
+        if date_plus1 <= de_zone_change:  # and date is earlier than 1-10-2018
             print('changing DE zone name')
             bid_zone = '10Y1001A1001A63L'
 
-    link = f'{api_adress}securityToken={sec_token}&documentType={doc_type}&processType={proc_type}&in_Domain={bid_zone}&periodStart={per_start}&periodEnd={per_end}'
-    response = rq.get(link)  # receive response
-    xmltext = response.text  # read xml text
-    root = et.fromstring(xmltext)  # convert to root structure
-
-    if bid_zone == '10YNL----------L' or bid_zone == '10Y1001A1001A82H' or bid_zone == '10Y1001A1001A63L':
-        time_points = 96
-    else:
-        time_points = 24
-
-    no_ts = len(root.findall('{urn:iec62325.351:tc57wg16:451-6:generationloaddocument:3:0}TimeSeries'))  # count number of columns (generation types) in received data
-    ddt = time_points  # number of timepoints in a day (24h/15m)
-    df = pd.DataFrame({'position': range(1, ddt+1)})  # create dataframe of length ddt
-    full_list = 1  # initiate full list
-    last_type = 0  # initiate last type
-    last_pos = 0  # initiate last position
-    for i in range(10, (no_ts + 10)):  # loop through all timeseries
-        no_p = len(root[i][7].findall('{urn:iec62325.351:tc57wg16:451-6:generationloaddocument:3:0}Point'))  # count number of points in timeseries
-        if last_type != root[i][6][0].text:  # check if current directory is the same as previous loop (in case of missing data)
-            full_list = 1
-        if (no_p + int(last_pos)) >= ddt:  # check if previous timeseries is full
-            full_list = 1
-        if full_list == 1 and last_type != root[i][6][0].text:  # give production tag to production timeseries
-            ts_tag = '_prod'
-        if full_list == 1 and last_type == root[i][6][0].text:  # give consumption tag to consumption timeseries
-            ts_tag = '_cons'
-        if no_p == ddt:  # true in case of a full list (no missing data)
-            entry = pd.DataFrame(columns=['position', root[i][6][0].text + ts_tag + '_full'])  # initiate dataframe to fill
-            for a in range(2, (no_p + 2)):  # loop through all the points
-                pos = root[i][7][a][0].text  # read the positions (time points)
-                qua = root[i][7][a][1].text  # read the quantities (generation data [MW])
-                entry.loc[len(entry)] = [int(pos), int(qua)]  # add pos and qua to entry dataframe
-            last_pos = root[i][7][(no_p + 1)][0].text  # read last position
-            last_type = root[i][6][0].text  # read last generation type
-            full_list = 1  # set full_list to 1
-            df = pd.merge(df, entry, how='outer', on='position')  # add entry data to df
-        elif full_list == 1:  # true in case of incomplete timeseries but previous timeseries is complete
-            entry = pd.DataFrame(columns=['position', root[i][6][0].text + ts_tag + '_base'])
-            for a in range(2, (no_p + 2)):
-                pos = root[i][7][a][0].text
-                qua = root[i][7][a][1].text
-                entry.loc[len(entry)] = [int(pos), int(qua)]
-            last_pos = root[i][7][(no_p + 1)][0].text
-            last_type = root[i][6][0].text
-            full_list = 0  # note that the timeseries was incomplete
-            print(f'WARNING: Missing Data Found in zone {bid_zone}, timeseries {root[i][6][0].text}. Appending missing values to timeseries as 0')
-            df = pd.merge(df, entry, how='outer', on='position')
-        else:  # in case of incomplete timeseries and incomplete previous timeseries
-            entry = pd.DataFrame(columns=['position', root[i][6][0].text + ts_tag + '_part' + f'_{i}'])
-            for a in range(2, (no_p + 2)):
-                pos = root[i][7][a][0].text
-                qua = root[i][7][a][1].text
-                entry.loc[len(entry)] = [int(pos) + int(last_pos), int(qua)]
-            last_pos = int(pos) + int(last_pos)  # add no_pos to last_pos of previous timeseries
-            last_type = root[i][6][0].text
-            if last_pos == ddt:  # check if timeseries is complete
-                full_list = 1
-            else:
-                full_list = 0
-            df = pd.merge(df, entry, how='outer', on='position')
-
-    prod_raw = df.filter(regex='prod')  # read the production data
-    prod = pd.DataFrame()
-    cons_raw = df.filter(regex='cons')  # read the consumption data
-    cons = pd.DataFrame()
-
-    def type_filter(dtf, dtf2, list_type):
-        for ent in list_type:
-            dtf[ent] = dtf2.filter(regex=ent).sum(axis=1)
-
-    type_list = ['B01', 'B02', 'BO3', 'B04', 'B05', 'B06', 'B07', 'B08', 'B09', 'B10', 'B11', 'B12', 'B13', 'B14', 'B15', 'B16', 'B17', 'B18', 'B19', 'B20']
-    type_filter(prod, prod_raw, type_list)  # merge production data of same type
-    type_filter(cons, cons_raw, type_list)  # merge consumption data of same type
-    df = prod  # - cons # (delete first hashtag to include consumption) subtract consumption from production
-
-    # change generation codes into readable tickers
-    names = {'B01': 'BIOD',
-             'B02': 'LIGN',
-             'BO3': 'COAG',
-             'B04': 'CCGT',
-             'B05': 'COAL',
-             'B06': 'OILS',
-             'B07': 'SHAL',
-             'B08': 'PEAT',
-             'B09': 'GEOT',
-             'B10': 'HYPS',
-             'B11': 'HYRR',
-             'B12': 'HYRS',
-             'B13': 'TIDE',
-             'B14': 'NUCL',
-             'B15': 'OTHR',
-             'B16': 'PVUT',
-             'B17': 'WSTE',
-             'B18': 'WDOF',
-             'B19': 'WDON',
-             'B20': 'OTHE'}
-    df = df.rename(columns=names)
-
-    # make column with datetime
-    date_list = []
-    date = date_initial
-    for i in range(time_points):
-        date_list.append(date.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))
-        date = date + dt.timedelta(minutes=1440/time_points)
-    df['datetime'] = date_list
-    df = df.set_index('datetime')
-
-    date_list = []
-    date = date_initial
-    date_time = pd.DataFrame()
-    for i in range(24):
-        date_list.append(date.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))
-        date = date + dt.timedelta(minutes=60)
-    date_time['datetime'] = date_list
-    df = date_time.merge(df, how='inner', on='datetime')
-    df = df.set_index('datetime')
-    # df = df.drop(columns=['datetime'])
-    print(f'Generation data   {zone_code}   {date_initial.astimezone(dt.timezone.utc).strftime("%Y-%m-%d")}')
+    params = {'securityToken': sec_token, 'documentType': doc_type, 'processType': proc_type, 'in_Domain': bid_zone}
+    index = hour_index(date, days)
+    hours = hour_axis(index)
+    # receive the response, or reuse the cached days, and read all timeseries from the xml
+    series = read_window(params, date, days, hours, f'generation data for zone {bid_zone} from {per_start} to {per_end}')
+
+    type_idx = {psr: i for i, psr in enumerate(type_list)}
+    series = [(ts, mask) for ts, mask in series if ts['psr'] in type_idx]
+    values = np.zeros((len(series), len(hours)))  # one row per timeseries, sampled at the full hours
+    found = np.zeros((len(series), len(hours)), dtype=bool)
+    for i, (ts, mask) in enumerate(series):
+        values[i], found[i] = sample_hours(ts, hours, mask)
+    series = [ts for ts, mask in series]
+    rows = np.array([type_idx[ts['psr']] for ts in series], dtype=int)
+    cons = np.array([ts['cons'] for ts in series], dtype=bool)
+
+    # sum the timeseries per generation type into the production and consumption matrices at once
+    prod = np.zeros((len(type_list), len(hours)))
+    cons_m = np.zeros((len(type_list), len(hours)))
+    np.add.at(prod, rows[~cons], values[~cons])
+    np.add.at(cons_m, rows[cons], values[cons])
+    prod_found = np.zeros((len(type_list), len(hours)), dtype=bool)
+    np.logical_or.at(prod_found, rows[~cons], found[~cons])
+    for i in np.unique(rows[~cons]):
+        if not prod_found[i].all():  # a generation type is reported, but not for every hour
+            print(f'WARNING: Missing Data Found in zone {bid_zone}, timeseries {type_list[i]}. Appending missing values to timeseries as 0')
+
+    df = pd.DataFrame(prod.T, columns=[names[t] for t in type_list], index=index)  # - cons_m.T # (delete first hashtag to include consumption) subtract consumption from production
+    print(f'Generation data   {zone_code}   {date.strftime("%Y-%m-%d")}   {days} day(s)')
     return df
 
 
-def fetch_import(date, key_entsoe):
+def fetch_import(date, key_entsoe, days=1):  # fetch import for a window of days, one request per zone
     # specific input parameters for data ENTSO-e request
     doc_type = "A11"
     in_dom = '10YNL----------L'
     sec_token = key_entsoe
-    date = dt.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')
-    y = date.astimezone(dt.timezone.utc).strftime('%Y')
-    m = date.astimezone(dt.timezone.utc).strftime('%m')
-    d = date.astimezone(dt.timezone.utc).strftime('%d')
-	
-    date_plus1 = date + dt.timedelta(days=1)
-    y_p1 = date_plus1.astimezone(dt.timezone.utc).strftime('%Y')
-    m_p1 = date_plus1.astimezone(dt.timezone.utc).strftime('%m')
-    d_p1 = date_plus1.astimezone(dt.timezone.utc).strftime('%d')
-
-    per_start = f'{y}{m}{d}0000'
-    per_end = f'{y_p1}{m_p1}{d_p1}0000'
-
-    dom_list = ['10YGB----------A',  # Great-Britain
-                '10YBE----------2',  # Belgium
-                '10Y1001A1001A82H',  # Germany
-                '10YDK-1--------W',  # Denmark
-                '10YNO-2--------T']  # Norway
-
-    df_main = pd.DataFrame()  # initiate main dataframe
+    zones = import_zones(date, days)
+    date_plus1 = date + pd.Timedelta(days=days)
+    per_start = date.strftime('%Y%m%d0000')
+    per_end = date_plus1.strftime('%Y%m%d0000')
+
+    index = hour_index(date, days)
+    hours = hour_axis(index)
+    df = pd.DataFrame(index=index)
     for out_dom in dom_list:  # loop through bidding zones
-        d_min = 60
-        if out_dom == '10YDK-1--------W' and int(per_end) <= 201909092200:
+        if out_dom not in zones:  # no import data published for this zone on date
             pass
         else:
             if out_dom == '10Y1001A1001A82H':
-                if int(per_end) <= 201809302200:  # and date is earlier than 1-10-2018
+                if date_plus1 <= de_zone_change:  # and date is earlier than 1-10-2018
                     print('changing DE zone name')
                     out_dom = '10Y1001A1001A63L'
-                if int(per_end) >= 202108010000:
-                    d_min = 15
-            if out_dom == '10YNO-2--------T':
-                d_min = 15
-            if out_dom == '10YGB----------A': # Don't include GB for data before 1-1-2022 the data was hourly. Same for DE before 1-8-2021
-                if int(per_start) >=  202112312200:  # and date is 1-1-2022 or later
-                    d_min = 15
-
-            link = f'{api_adress}securityToken={sec_token}&documentType={doc_type}&in_Domain={in_dom}&out_Domain={out_dom}&periodStart={per_start}&periodEnd={per_end}'
-            # receive response and load xml
-            response = rq.get(link)
-            xmltext = response.text
-            root = et.fromstring(xmltext)
-
-            # create dataframe from xml
-            no_p = len(root[9][6].findall('{urn:iec62325.351:tc57wg16:451-3:publicationdocument:7:0}Point'))
-            entry = pd.DataFrame(columns=[out_dom])
-            
-            for a in range(2, (no_p + 2)):
-                # pos = root[9][6][a][0].text
-                qua = root[9][6][a][1].text
-                entry.loc[len(entry)] = [int(qua)]
-
-            date_list = []
-            date_var = date
-            for i in range(int(1440/d_min)):
-                date_list.append(date_var.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))
-                date_var = date_var + dt.timedelta(minutes=d_min)
-            try:
-                entry['datetime'] = date_list
-            except:
+
+            params = {'securityToken': sec_token, 'documentType': doc_type, 'in_Domain': in_dom, 'out_Domain': out_dom}
+            # receive response, or reuse the cached days, and load xml
+            series = read_window(params, date, days, hours, f'import data from zone {out_dom} from {per_start} to {per_end}')
+
+            entry = np.zeros(len(hours))
+            found = np.zeros(len(hours), dtype=bool)
+            for ts, mask in series:  # normally one timeseries per zone, sampled at the full hours
+                v, f = sample_hours(ts, hours, mask)
+                entry += v
+                found |= f
+            if not found.all():
                 print(f'WARNING: Missing Data Found in cross-border exchange with zone {out_dom}. Appending missing values to timeseries as 0')
-                i = len(entry)
-                while(len(entry) < len(date_list)):
-                    entry.loc[len(entry)] = 0
-                entry['datetime'] = date_list
-
-            if out_dom == '10YGB----------A':
-                df_main = entry
-            else:
-                df_main = entry.merge(df_main, how='inner', on='datetime')
-            print(f'Import data   {out_dom}   {date.astimezone(dt.timezone.utc).strftime("%Y-%m-%d")}')
-    df = df_main
-    names = {'10YBE----------2': 'im_BE', '10Y1001A1001A82H': 'im_DE', '10YDK-1--------W': 'im_DK', '10YGB----------A': 'im_GB', '10YNO-2--------T': 'im_NO', '10Y1001A1001A63L': 'im_DE'}
-    df = df.rename(columns=names)
-    df = df.set_index('datetime')
-    # df = df.drop(columns=['datetime'])
+            df[out_dom] = entry
+            print(f'Import data   {out_dom}   {date.strftime("%Y-%m-%d")}   {days} day(s)')
+    zone_names = {'10YBE----------2': 'im_BE', '10Y1001A1001A82H': 'im_DE', '10YDK-1--------W': 'im_DK', '10YGB----------A': 'im_GB', '10YNO-2--------T': 'im_NO', '10Y1001A1001A63L': 'im_DE'}
+    df = df.rename(columns=zone_names)
     return df
+
+
+def read_window(params, date, days, hours, what):  # (timeseries, mask of the hours to take from it) of the cached or downloaded documents of a window
+    series = []
+    for xmltext, doc_days in cache.get_days('entsoe', api_adress, params, date, days, 'entsoe'):
+        doc_series = parse_document(xmltext)
+        if len(doc_series) == 0:  # acknowledgement without data, fail the window instead of storing zeros
+            raise ValueError(f'No {what}: {document_reason(xmltext)}')
+        mask = np.zeros(len(hours), dtype=bool)  # the hours of the days this document is used for
+        for day in doc_days:
+            first = np.datetime64(day.tz_convert(None), 'm')
+            mask |= (hours >= first) & (hours < first + np.timedelta64(1, 'D'))
+        series += [(ts, mask) for ts in doc_series]
+    return series
+
+
+def parse_document(xmltext):  # stream an ENTSO-e document into a list of timeseries with numpy arrays per period
+    series = []
+    ts = None
+    per = None
+    for event, elem in et.iterparse(io.BytesIO(xmltext), events=('start', 'end')):
+        tag = elem.tag.rsplit('}', 1)[-1]  # strip the namespace, which differs per document type
+        if event == 'start':
+            if tag == 'TimeSeries':
+                ts = {'psr': None, 'cons': False, 'curve': 'A01', 'periods': []}
+            elif tag == 'Period' and ts is not None:
+                per = {'start': None, 'end': None, 'res': None, 'pos': [], 'qua': []}
+            continue
+        if ts is None:  # document header
+            continue
+        if per is not None:
+            if tag == 'start':
+                per['start'] = np.datetime64(elem.text.rstrip('Z'), 'm')
+            elif tag == 'end':
+                per['end'] = np.datetime64(elem.text.rstrip('Z'), 'm')
+            elif tag == 'resolution':
+                per['res'] = resolution_minutes(elem.text)
+            elif tag == 'position':
+                per['pos'].append(elem.text)
+            elif tag == 'quantity':
+                per['qua'].append(elem.text)
+            elif tag == 'Period':
+                per['pos'] = np.array(per['pos'], dtype=np.int64)
+                per['qua'] = np.array(per['qua'], dtype=float)
+                ts['periods'].append(per)
+                per = None
+        elif tag == 'psrType':
+            ts['psr'] = elem.text
+        elif tag == 'outBiddingZone_Domain.mRID':  # consumption timeseries have an out instead of an in domain
+            ts['cons'] = True
+        elif tag == 'curveType':
+            ts['curve'] = elem.text
+        elif tag == 'TimeSeries':
+            series.append(ts)
+            ts = None
+            elem.clear()
+    return series
+
+
+def document_reason(xmltext):  # reason text of an ENTSO-e acknowledgement document
+    try:
+        root = et.fromstring(xmltext)
+    except et.ParseError:
+        return xmltext[:300].decode(errors='replace')
+    texts = [elem.text for elem in root.iter() if elem.tag.rsplit('}', 1)[-1] == 'text' and elem.text]
+    return ' '.join(texts) if len(texts) > 0 else 'no timeseries in document'
+
+
+def resolution_minutes(resolution):  # convert an ISO 8601 duration such as PT15M or PT1H into minutes
+    match = re.fullmatch(r'PT(?:(\d+)H)?(?:(\d+)M)?', resolution)
+    if match is None:
+        raise ValueError(f'Unsupported resolution in ENTSO-e document: {resolution}')
+    return int(match.group(1) or 0) * 60 + int(match.group(2) or 0)
+
+
+def sample_hours(ts, hours, mask=None):  # values of a timeseries at the full hours, and whether each hour was found, only for the hours in mask if given
+    values = np.zeros(len(hours))
+    found = np.zeros(len(hours), dtype=bool)
+    for per in ts['periods']:
+        if len(per['pos']) == 0:
+            continue
+        times = per['start'] + (per['pos'] - 1) * np.timedelta64(per['res'], 'm')  # timestamp of every point
+        order = np.argsort(times)
+        times = times[order]
+        qua = per['qua'][order]
+        end = per['end'] if per['end'] is not None else times[-1] + np.timedelta64(per['res'], 'm')
+        if ts['curve'] == 'A03':  # points are only given when the value changes, each point holds until the next one
+            k = np.searchsorted(times, hours, side='right') - 1
+            hit = (k >= 0) & (hours < end)
+        else:  # every point is given, hours without a point are missing
+            k = np.minimum(np.searchsorted(times, hours), len(times) - 1)
+            hit = times[k] == hours
+        if mask is not None:
+            hit &= mask
+        values[hit] = qua[k[hit]]
+        found |= hit
+    return values, found
+
+
+def hour_axis(index):  # full hours of an index as numpy datetimes in UTC minutes, the unit of the parsed periods
+    return index.tz_convert(None).to_numpy().astype('datetime64[m]')
@@ -12,102 +12,169 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import csv
-import requests
+import io
+import json
+import numpy as np
 import pandas as pd
-import datetime as dt
 import os
+import threading
+import time
+
+from lib import client
+from lib.store import hour_index, epoch_seconds
+
+# days can be fetched concurrently, so only one thread may download the shared database at a time
+gb_lock = threading.Lock()
+
+filename = 'data/Database_GB_Generation.csv'
+meta_file = 'data/Database_GB_Generation.json'	# validators, downloaded size and last stored timestamp of the database
+overlap = 1024	# bytes before the end of the stored part that are downloaded again to check that it did not change
+recheck = 3000	# seconds before the source is checked again for new data, less than an hour so every hourly run can check it
+
+# Source: https://www.nationalgrideso.com/data-portal/historic-generation-mix
+url = 'https://data.nationalgrideso.com/backend/dataset/88313ae5-94e4-4ddc-a790-593554d8c6b9/resource/f93d1835-75bc-43e5-84ad-12472b180a98/download/df_fuel_ckan.csv'
+
+names = {'GAS_perc': 'CCGT_GB',	# columns of the database and their names in the generation mix
+		 'COAL_perc': 'COAL_GB',
+		 'NUCLEAR_perc': 'NUCL_GB',
+		 'WIND_perc': 'WDON_GB',
+		 'HYDRO_perc': 'HYRS_GB',
+		 'BIOMASS_perc': 'BIOD_GB',
+		 'OTHER_perc': 'OTHR_GB',
+		 'SOLAR_perc': 'PVUT_GB'}
+
+gb_frame = None	 # parsed database, loaded once per process and indexed by UTC timestamp in seconds
+gb_stat = None	# size and modification time of the database file when gb_frame was loaded
+
+
+def fetch_gb_generation(date, days=1):
+	index = hour_index(date, days)	# every hour of the queried window
+	hours = epoch_seconds(index)
+	with gb_lock:
+		df = load_gb()
+		if hours[-1] in df.index:	# check if the last hour of the window is already present in the database file
+			print(f'British data for {index[-1].strftime("%Y-%m-%d %H:%M")} already in database, skipping download')
+		elif update_gb():  # download only the rows that are newer than the database
+			df = load_gb()
+
+	lo, hi = np.searchsorted(df.index.values, [hours[0], hours[-1] + 1])  # rows of the window, the index is sorted
+	gb_gen = df.iloc[lo:hi]
+	gb_gen = gb_gen[np.isin(gb_gen.index.values, hours)]  # select the full hours
+	gb_gen = gb_gen.astype(float).div(100)	# convert percentages to fractions
+	gb_gen.index = index[np.searchsorted(hours, gb_gen.index.values)]
+	return gb_gen
 
 
-def fetch_gb_generation(date):
-	date = dt.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')
-	year = date.astimezone(dt.timezone.utc).strftime('%Y')
-	month = date.astimezone(dt.timezone.utc).strftime('%m')
-	day = date.astimezone(dt.timezone.utc).strftime('%d')
-	date_str = f'{year}-{month}-{day} 00:00'
-	filename = 'data/Database_GB_Generation.csv'
-	exists = os.path.exists(filename)
-	
-	if exists:	# Check if Database_GB_Generation.csv is present
-		pass  # Do nothing
+def load_gb():	# parsed database, only read from disk again when the file changed
+	global gb_frame, gb_stat
+	if not os.path.exists(filename):
+		return pd.DataFrame(columns=list(names.values()), dtype=np.float32, index=pd.Index([], dtype=np.int64))
+	stat = os.stat(filename)
+	if gb_frame is None or gb_stat != (stat.st_size, stat.st_mtime_ns):
+		df = pd.read_csv(filename, usecols=['DATETIME'] + list(names.keys()))
+		ts = parse_timestamps(df['DATETIME'])
+		df = df.drop(columns=['DATETIME']).rename(columns=names).astype(np.float32)
+		df.index = ts
+		df = df[df.index >= 0].sort_index()	 # drop rows with an unreadable timestamp
+		gb_frame = df[~df.index.duplicated(keep='last')]
+		gb_stat = (stat.st_size, stat.st_mtime_ns)
+	return gb_frame
+
+
+def parse_timestamps(column):  # UTC timestamps in seconds of a column of ISO 8601 strings, -1 where unreadable
+	ts = pd.to_datetime(column, utc=True, format='ISO8601', errors='coerce')
+	secs = ts.dt.tz_convert(None).to_numpy().astype('datetime64[s]').astype(np.int64)
+	secs[ts.isna().to_numpy()] = -1
+	return secs
+
+
+def update_gb():  # append new rows of the source to the database, returns True if rows were added
+	meta = {}
+	if os.path.exists(meta_file) and os.path.exists(filename):
+		with open(meta_file) as f:
+			meta = json.load(f)
+
+	if time.time() - meta.get('checked', 0) < recheck:	# the source was checked recently, it will not have new data yet
+		print(f'British generation data was checked less than {recheck // 60} minutes ago, skipping download')
+		return False
+
+	print('Downloading British generation data')
+	response = request_gb(meta)
+	meta['checked'] = time.time()
+	if response.status_code == 304:	# nothing new
+		response.close()
+		write_meta(meta)
+		return False
+	new = None
+	if response.status_code == 206:
+		content = response.content
+		tail = meta['tail'].encode('latin-1')
+		if range_start(response) == meta['size'] - len(tail) and content[:len(tail)] == tail:	# the part we have did not change
+			new = content[len(tail):]	# the rows after the stored part, without header
+	if new is None and response.status_code in [206, 416]:	# the file was rewritten, or got shorter: download all of it
+		for key in ['size', 'tail', 'etag', 'last_modified']:
+			meta.pop(key, None)
+		response = request_gb(meta)
+
+	if new is not None:
+		with open(filename) as f:
+			columns = f.readline().strip().split(',')
+		df = pd.read_csv(io.BytesIO(new), header=None, names=columns, dtype=str) if len(new.strip()) > 0 else pd.DataFrame(columns=columns, dtype=str)
+		last_time = meta.get('last', 0)
+		content = tail + new
+		meta['size'] += len(new)
+	elif response.status_code == 200:  # the complete file, the server does not support ranges or the file changed
+		content = response.content
+		df = pd.read_csv(io.BytesIO(content), dtype=str)  # keep the text as is, it is only filtered
+		last_time = 0
+		meta['size'] = len(content) if response.headers.get('Content-Encoding') is None else None	# ranges refer to the encoded file
+	else:
+		print(f'Unable to download British generation data ({response.status_code})')
+		response.close()
+		write_meta(meta)
+		return False
+	meta['tail'] = content[-overlap:].decode('latin-1')	# last bytes of the source, compared with the start of the next range
+	meta['etag'] = response.headers.get('ETag')
+	meta['last_modified'] = response.headers.get('Last-Modified')
+
+	# keep rows that are newer than every row before them, starting from the last stored timestamp
+	ts = parse_timestamps(df[df.columns[0]])
+	before = np.maximum.accumulate(np.concatenate([[last_time], ts]))[:-1]
+	keep = (ts >= 0) & (ts > before)
+	df = df[keep]
+	if response.status_code == 206:
+		df.to_csv(filename, mode='a', header=False, index=False)
 	else:
-		dbgen = pd.DataFrame(columns=['DATETIME', 'GAS', 'COAL', 'NUCLEAR', 'WIND', 'HYDRO', 'IMPORTS',	 # Initiate Database_GB_Generation
-									  'BIOMASS', 'OTHER', 'SOLAR', 'STORAGE', 'GENERATION',
-									  'CARBON_INTENSITY', 'LOW_CARBON', 'ZERO_CARBON', 'RENEWABLE', 'FOSSIL',
-									  'GAS_perc', 'COAL_perc', 'NUCLEAR_perc', 'WIND_perc', 'HYDRO_perc',
-									  'IMPORTS_perc', 'BIOMASS_perc', 'OTHER_perc', 'SOLAR_perc',
-									  'STORAGE_perc', 'GENERATION_perc', 'LOW_CARBON_perc',
-									  'ZERO_CARBON_perc', 'RENEWABLE_perc', 'FOSSIL_perc'])
-		dbgen.to_csv(filename)	# create Database_GB_Generation.csv
-
-	df = pd.read_csv(filename)
+		df.to_csv(filename, index=False)
+	if keep.any():
+		meta['last'] = int(ts[keep].max())
+	else:
+		meta['last'] = int(last_time)
+	write_meta(meta)
+	print(f'Added {len(df)} rows of British generation data')
+	return len(df) > 0
+
+
+def request_gb(meta):  # conditional request for the source, from shortly before the end of the stored part if we have it
+	headers = {}
+	if meta.get('etag') is not None:  # the server answers 304 if the file did not change
+		headers['If-None-Match'] = meta['etag']
+	elif meta.get('last_modified') is not None:
+		headers['If-Modified-Since'] = meta['last_modified']
+	if meta.get('size') is not None and meta.get('tail') is not None:
+		# the file is normally only appended to, the overlap with the stored part shows whether that part is unchanged
+		headers['Range'] = f"bytes={meta['size'] - len(meta['tail'])}-"
+	return client.get(url, 'gb', headers=headers)
+
+
+def range_start(response):  # first byte of a partial response, None if unknown
 	try:
-		df['DATETIME'] = pd.to_datetime(df['DATETIME'], format='%Y-%m-%dT%H:%M:%S')	# change column into datetime
-	except:
-		try:
-			df['DATETIME'] = pd.to_datetime(df['DATETIME'], format='%Y-%m-%d %H:%M:%S+00:00')  # change column into datetime #df['DATETIME'] = pd.to_datetime(df['DATETIME'], format='%Y-%m-%dT%H:%M:%S')	# change column into datetime
-		except:
-			df['DATETIME'] = pd.to_datetime(df['DATETIME'], format='%Y-%m-%d %H:%M:%S+00')	# change column into datetime
-			
-	df['DATETIME'] = df['DATETIME'].dt.strftime('%Y-%m-%d %H:%M%z')  # change datetime format
-
-	if date_str in df.DATETIME.values:	# check if date_str is already present in the database file
-		print(f'British data for {date_str} already in database, skipping download')
-	else:  # download new file
-		last_time = 0
-		first_line = True
-		
-		# Source: https://www.nationalgrideso.com/data-portal/historic-generation-mix
-		print('Downloading British generation data')
-		url = 'https://data.nationalgrideso.com/backend/dataset/88313ae5-94e4-4ddc-a790-593554d8c6b9/resource/f93d1835-75bc-43e5-84ad-12472b180a98/download/df_fuel_ckan.csv'
-
-		response = requests.get(url)
-		with open(filename, 'w+') as f:
-			writer = csv.writer(f)
-			for line in response.iter_lines():
-				l = line.decode('utf-8').split(',')
-				if first_line:
-					first_line = False
-					writer.writerow(l)
-				else:
-					try:
-						ts = int(dt.datetime.strptime(l[0], '%Y-%m-%d %H:%M:%S%z').timestamp())
-					except:
-						try:
-							ts = int(dt.datetime.strptime(l[0]+"Z", '%Y-%m-%dT%H:%M:%S%z').timestamp())
-						except:
-							pass
-						
-					try:
-						if ts > last_time:
-							writer.writerow(l)
-							last_time = ts
-					except:
-						pass
-
-	gb_gen = pd.DataFrame()	 # initiate empty dataframe
-
-	gb_gen['CCGT_GB'] = df['GAS_perc']	# write Gas columns to the correct format
-	gb_gen['COAL_GB'] = df['COAL_perc']
-	gb_gen['NUCL_GB'] = df['NUCLEAR_perc']
-	gb_gen['WDON_GB'] = df['WIND_perc']
-	gb_gen['HYRS_GB'] = df['HYDRO_perc']
-	gb_gen['BIOD_GB'] = df['BIOMASS_perc']
-	gb_gen['OTHR_GB'] = df['OTHER_perc']
-	gb_gen['PVUT_GB'] = df['SOLAR_perc']
-
-	gb_gen = gb_gen.div(100)  # convert percentages to fractions
-
-	gb_gen['datetime'] = df['DATETIME']
-	gb_gen = gb_gen.set_index('datetime')
-
-	date_initial = dt.datetime(int(year), int(month), int(day))
-	date_var = date_initial
-	date_list = []
-	for i in range(24):
-		date_list.append(date_var.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))  # create date_list with the queried data and every hour of the day
-		date_var = date_var + dt.timedelta(hours=1)
-
-	gb_gen = gb_gen.loc[gb_gen.index.isin(date_list)]  # select rows within date_list
-	return gb_gen
+		return int(response.headers['Content-Range'].split(' ')[1].split('-')[0])
+	except (KeyError, IndexError, ValueError):
+		return None
+
 
+def write_meta(meta):
+	with open(meta_file + '.tmp', 'w') as f:
+		json.dump(meta, f)
+	os.replace(meta_file + '.tmp', meta_file)
@@ -13,319 +13,298 @@
 # limitations under the License.
 
 # import packages
-import datetime as dt
-import requests
-import sys
 import pandas as pd
 import netCDF4 as nc
 import numpy as np
 import math as mt
 import os
-
-
-def fetch_wind(date, key_knmi):
-	date = dt.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')	 # decode date as datetime
-	y = date.astimezone(dt.timezone.utc).strftime(f'%Y')  # select year
-	m = date.astimezone(dt.timezone.utc).strftime(f'%m')  # select month
-	d = date.astimezone(dt.timezone.utc).strftime(f'%d')  # select day
-	delta = dt.timedelta(minutes=60)  # set hourly interval
-
-	date_var = date	 # set initial value for date_var
-	df = pd.DataFrame()	 # create empty dataframe
-	date_list = []	# create empty list
-	for i in range(24):	 # run loops 24 times
-		y = date_var.astimezone(dt.timezone.utc).strftime(f'%Y')  # select year
-		m = date_var.astimezone(dt.timezone.utc).strftime(f'%m')  # select month
-		d = date_var.astimezone(dt.timezone.utc).strftime(f'%d')  # select day
-		h = date_var.astimezone(dt.timezone.utc).strftime(f'%H')
-		date2 = date_var - dt.timedelta(minutes=120)
-		y2 = date2.astimezone(dt.timezone.utc).strftime(f'%Y')	# select year
-		m2 = date2.astimezone(dt.timezone.utc).strftime(f'%m')	# select month
-		d2 = date2.astimezone(dt.timezone.utc).strftime(f'%d')	# select day
-		h2 = date2.astimezone(dt.timezone.utc).strftime(f'%H')
-		#wind = knmi_ir(y2, m2, d2, h2, 'wind', y, m, d, h, key_knmi)  # fetch file from KNMI
-		wind = knmi_ir(y, m, d, h, 'wind', y, m, d, h, key_knmi)  # fetch file from KNMI
-		df = pd.concat([df, wind])	# add data from KNMI to dataframe
-		date_list.append(date_var.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))  # add date to date_list
-		date_var = date_var + delta	 # increase date_var with delta
-	wind_df = df
-	wind_df.to_csv('data/wind_df.csv')
-
-	cap_onshore = {'DR': [222],	 # capacity of onshore wind turbines in MW https://opendata.cbs.nl/#/CBS/nl/dataset/70960ned/table
-				   'FL': [1351],
-				   'FR': [581],
-				   'GD': [171],
-				   'GR': [734],
-				   'LB': [72],
-				   'NB': [300],
-				   'NH': [668],
-				   'OV': [74],
-				   'UT': [34],
-				   'ZL': [567],
-				   'ZH': [535]}
-	wind_cap = pd.DataFrame(data=cap_onshore)  # fit capacity data to dataframe
-
-	rot_onshore = {'DR': [847000],	# rotor area of onshore wind turbines in m2 https://opendata.cbs.nl/#/CBS/nl/dataset/70960ned/table
-				   'FL': [3724000],
-				   'FR': [1951000],
-				   'GD': [608000],
-				   'GR': [2194000],
-				   'LB': [277000],
-				   'NB': [974000],
-				   'NH': [2129000],
-				   'OV': [230000],
-				   'UT': [131000],
-				   'ZL': [1721000],
-				   'ZH': [1640000]}
-	wind_rotor = pd.DataFrame(data=rot_onshore)	 # fit capacity data to dataframe
-
-	air_density = 1.246	 # kg/m3
-	turbine_efficiency = 0.26  # percentage of total wind power converted into electrical power
-	measurement_height = 10	 # height at which wind speed is measured by KNMI
-	average_hub_height = 119  # average height of wind turbine axis
-	surface_roughness = 0.20  # Hellman exponent 0.10-0.25 for completely flat surface to urban environment respectively https://www.intechopen.com/chapters/17121
-
-	ws_conversion_factor = mt.pow((average_hub_height / measurement_height), surface_roughness)
-	cut_in_speed = 5  # speed at which turbine start to produce electricity in m/s
-	cut_out_speed = 21	# speed at which turbine shuts off in m/s
-
-	# convert to the right units
-	# replace values outside of cutin-cutout with zero
-	prov_list = ['GR', 'FR', 'FL', 'OV', 'NH', 'ZH', 'ZL', 'UT', 'GD', 'LB', 'DR', 'NB']
-	wind_power = pd.DataFrame()
-	wind_speed = pd.DataFrame()
-	wind_speed_10m = wind_df
-
-	for prov in prov_list:
-		wind_speed[prov] = wind_speed_10m[prov].mul(ws_conversion_factor)
-		wind_speed[prov] = wind_speed[prov].where(wind_speed[prov] >= cut_in_speed, other=0)
-		wind_speed[prov] = wind_speed[prov].where(wind_speed[prov] <= cut_out_speed, other=0)
-		wind_speed[prov] = wind_speed[prov].pow(3)	# convert to (m/s)^3
-		wind_power[prov] = wind_speed[prov].mul(wind_rotor[prov])
-		wind_power[prov] = wind_power[prov].div(2)	# halving as the equation does
-		wind_power[prov] = wind_power[prov].mul(air_density)  # multiplying with air density
-		wind_power[prov] = wind_power[prov].div(1000000)  # converting Watts into MW
-		wind_power[prov] = wind_power[prov].mul(turbine_efficiency).round(2)  # converting MW of wind power into electric power
-		wind_power[prov] = wind_power[prov].clip(0, wind_cap[prov])
-
-	wps = pd.DataFrame()
-	wps['WDNS_NL'] = wind_power.sum(axis='columns')
-	wps['datetime'] = date_list
-	wps = wps.set_index('datetime')
-
-	return wps
-
-
-def fetch_pv(date, key_knmi):
-	date = dt.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')	 # decode date as datetime
-	y = date.astimezone(dt.timezone.utc).strftime(f'%Y')  # select year
-	m = date.astimezone(dt.timezone.utc).strftime(f'%m')  # select month
-	d = date.astimezone(dt.timezone.utc).strftime(f'%d')  # select day
-	delta = dt.timedelta(minutes=60)  # set hourly interval
-
-	date_var = date	 # set initial value for date_var
-	df = pd.DataFrame()	 # create empty dataframe
-	date_list = []	# create empty list
-	for i in range(24):	 # run loops 24 times
-		y = date_var.astimezone(dt.timezone.utc).strftime(f'%Y')  # select year
-		m = date_var.astimezone(dt.timezone.utc).strftime(f'%m')  # select month
-		d = date_var.astimezone(dt.timezone.utc).strftime(f'%d')  # select day
-		h = date_var.astimezone(dt.timezone.utc).strftime(f'%H')
-		date2 = date_var - dt.timedelta(minutes=120)
-		y2 = date2.astimezone(dt.timezone.utc).strftime(f'%Y')	# select year
-		m2 = date2.astimezone(dt.timezone.utc).strftime(f'%m')	# select month
-		d2 = date2.astimezone(dt.timezone.utc).strftime(f'%d')	# select day
-		h2 = date2.astimezone(dt.timezone.utc).strftime(f'%H')
-		#irr = knmi_ir(y2, m2, d2, h2, 'pv', y, m, d, h, key_knmi)  # fetch file from KNMI
-		irr = knmi_ir(y, m, d, h, 'pv', y, m, d, h, key_knmi)  # fetch file from KNMI
-		df = pd.concat([df, irr])  # add data from KNMI to dataframe
-		date_list.append(date_var.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))  # add date to date_list
-		date_var = date_var + delta	 # increase date_var with delta
-	pv_irr = df
-	pv_irr.to_csv('data/pv_irr.csv')
-
-	# set installed PV capacity per province [MWp]
-	cap_total = {'DR': [1065],
-				 'FL': [636],
-				 'FR': [948],
-				 'GD': [2240],
-				 'GR': [1233],
-				 'LB': [1318],
-				 'NB': [2991],
-				 'NH': [1624],
-				 'OV': [1465],
-				 'UT': [880],
-				 'ZL': [670],
-				 'ZH': [1785]}
-	pv_cap = pd.DataFrame(data=cap_total)  # fit capacity data to dataframe
-
-	cap_roof = {'DR': [512],
-				'FL': [440],
-				'FR': [696],
-				'GD': [1881],
-				'GR': [543],
-				'LB': [1233],
-				'NB': [2708],
-				'NH': [1424],
-				'OV': [1178],
-				'UT': [792],
-				'ZL': [406],
-				'ZH': [1612]}
-	cap_roof = pd.DataFrame(data=cap_roof)	# fit capacity data to dataframe
-
-	cap_field = {'DR': [553],
-				 'FL': [196],
-				 'FR': [252],
-				 'GD': [358],
-				 'GR': [689],
-				 'LB': [85],
-				 'NB': [282],
-				 'NH': [200],
-				 'OV': [288],
-				 'UT': [88],
-				 'ZL': [264],
-				 'ZH': [173]}
-	cap_field = pd.DataFrame(data=cap_field)  # fit capacity data to dataframe
-
-	col = pv_irr.columns  # read columns from pv_irr
-	pvro = pd.DataFrame()  # create empty dataframe
-	pvfi = pd.DataFrame()
-	pvro[col] = np.multiply(pv_irr[col], cap_roof[col].values[:1])	# multiply irradiation data with capacities
-	pvro = pvro.div(1000)  # divide by 1000 W/m2 to get actual generation
-	pvfi[col] = np.multiply(pv_irr[col], cap_field[col].values[:1])
-	pvfi = pvfi.div(1000)
-	pv_n = 0.836  # 1 - all system and placement losses, 16.4 percent in calibration with cbs data
-	pvro = pvro.mul(pv_n)  # multiply by PV_n to account for losses
-	pvfi = pvfi.mul(pv_n)
-	pvro.to_csv('data/pvro.csv')
-	pvfi.to_csv('data/pvfi.csv')
-	df = pd.DataFrame()	 # create empty dataframe
-	df['PVRO_NL'] = pvro.sum(axis=1)  # sum generation over all provinces to obtain national generation
-	df['PVFI_NL'] = pvfi.sum(axis=1)
-	df['datetime'] = date_list	# add date_list to df
-	df = df.set_index('datetime')  # set datetime as index
-	return df
-
-
-def knmi_ir(y, m, d, h, tech, y2, m2, d2, h2, key_knmi):
-	# Parameters
-	api_url = "https://api.dataplatform.knmi.nl/open-data"
-	api_version = "v1"
-	api_key = key_knmi
-	dataset_name = "Actuele10mindataKNMIstations"
-	dataset_version = "2"
-	filename = f'KMDS__OPER_P___10M_OBS_L2_{y}{m}{d}{h}00.nc'
-
-	# fetching temporary Download URL
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import client
+from lib.config import update_settings
+from lib.store import MonthlyStore, hour_index
+
+api_url = "https://api.dataplatform.knmi.nl/open-data"
+api_version = "v1"
+dataset_name = "Actuele10mindataKNMIstations"
+dataset_version = "2"
+folder = 'data/KNMI_Data'
+archive_folder = 'data/weather'	 # station values of the hourly files, per month, so the files can be removed once they are archived
+variables = ['qg', 'ff']  # qg is the irradiation and ff the wind speed in KNMI data
+download_workers = 8  # concurrent KNMI downloads per window, the rate limiter of the client keeps them within the quota
+list_page = 500	 # files per listing page
+
+# windows of different days run concurrently, so each file gets a lock to avoid downloading it twice
+file_locks = {}
+file_locks_lock = threading.Lock()
+
+
+def file_lock(filename):
+	with file_locks_lock:
+		return file_locks.setdefault(filename, threading.Lock())
+
+
+nc_lock = threading.Lock()  # the netCDF/HDF5 library is not thread-safe, so files are read one at a time
+archive_lock = threading.Lock()	# windows update the archive concurrently
+
+# weather stations that are incorporated in the calculation of province averages
+province_stations = {'DR': ['MARKNESSE AWS', 'HOOGEVEEN AWS', 'GRONINGEN AP EELDE', 'NIEUW BEERTA AWS'],
+					 'FL': ['STAVOREN AWS', 'LELYSTAD AP', 'MARKNESSE AWS'],
+					 'FR': ['TERSCHELLING HOORN AWS', 'STAVOREN AWS', 'LEEUWARDEN', 'LAUWERSOOG AWS'],
+					 'GD': ['LELYSTAD AP', 'DEELEN', 'HEINO AWS', 'HUPSEL AWS', 'HERWIJNEN AWS'],
+					 'GR': ['LAUWERSOOG AWS', 'GRONINGEN AP EELDE', 'NIEUW BEERTA AWS'],
+					 'LB': ['ELL AWS', 'MAASTRICHT AACHEN AP', 'ARCEN AWS'],
+					 'NB': ['GILZE RIJEN', 'HERWIJNEN AWS', 'EINDHOVEN AP', 'VOLKEL'],
+					 'NH': ['DE KOOY VK', 'AMSTERDAM/SCHIPHOL AP', 'BERKHOUT AWS', 'WIJK AAN ZEE AWS'],
+					 'OV': ['MARKNESSE AWS', 'HEINO AWS', 'HOOGEVEEN AWS', 'HUPSEL AWS', 'TWENTHE AWS'],
+					 'UT': ['AMSTERDAM/SCHIPHOL AP', 'DE BILT AWS', 'CABAUW TOWER AWS', 'HERWIJNEN AWS'],
+					 'ZL': ['VLISSINGEN AWS', 'WESTDORPE AWS', 'WILHELMINADORP AWS', 'HOEK VAN HOLLAND AWS'],
+					 'ZH': ['VOORSCHOTEN AWS', 'AMSTERDAM/SCHIPHOL AP', 'HOEK VAN HOLLAND AWS', 'ROTTERDAM THE HAGUE AP', 'CABAUW TOWER AWS']}
+provinces = list(province_stations.keys())
+stations = pd.Index(sorted(set(s for names in province_stations.values() for s in names)))
+
+
+def station_weights():	# stations x provinces matrix, equal weights for the stations of a province
+	weights = np.zeros((len(stations), len(provinces)))
+	for j, prov in enumerate(provinces):
+		weights[stations.get_indexer(province_stations[prov]), j] = 1
+	return weights
+
+
+weights = station_weights()	 # built once, province values are normalised by the weights of the stations that reported
+
+
+def knmi_filename(date):
+	return f'KMDS__OPER_P___10M_OBS_L2_{date.strftime("%Y%m%d%H%M")}.nc'
+
+
+def file_hour(filename):  # UTC timestamp of a file
+	return pd.to_datetime(filename[26:38], format='%Y%m%d%H%M', utc=True)
+
+
+def download_knmi(date, key_knmi, days=1):  # download the hourly files of a window, so pv and wind only read local files
+	hours = hour_index(date, days)
+	os.makedirs(folder, exist_ok=True)	# make new folder if it does not exist yet
+	with archive_lock:
+		archived = archived_hours(knmi_archive(), hours[0], hours[-1])
+	missing = [knmi_filename(h) for h in hours[~hours.isin(archived)] if not os.path.exists(f'{folder}/{knmi_filename(h)}')]
+	if len(missing) == 0:
+		return
+
+	available = list_files(hours[0], hours[-1], key_knmi)	# one paginated listing instead of a request per file
+	if available is not None:
+		for filename in missing:
+			if filename not in available:
+				print(f'KNMI file {filename} is not available. Adding zeroes')
+		missing = [f for f in missing if f in available]
+
+	with ThreadPoolExecutor(max_workers=download_workers) as pool:
+		futures = [pool.submit(download_file, filename, key_knmi) for filename in missing]
+	for future in futures:
+		future.result()
+
+
+def list_files(first, last, key_knmi):	# names of the files of the dataset from first to last, None if the listing fails
+	endpoint = f"{api_url}/{api_version}/datasets/{dataset_name}/versions/{dataset_version}/files"
+	params = {'maxKeys': list_page,
+			  'orderBy': 'filename',
+			  'sorting': 'asc',
+			  'startAfterFilename': knmi_filename(first - pd.Timedelta(minutes=1))}
+	last_name = knmi_filename(last)
+	files = set()
+	while True:
+		response = client.get(endpoint, 'knmi', headers={'Authorization': key_knmi}, params=params)
+		if response.status_code != 200:
+			print(response.status_code)
+			print(response.text)
+			print("Unable to list KNMI files, requesting each file separately")
+			return None
+		listing = response.json()
+		names = [f['filename'] for f in listing.get('files', [])]
+		files.update(n for n in names if n <= last_name)
+		if not listing.get('isTruncated') or listing.get('nextPageToken') is None or len(names) == 0 or names[-1] >= last_name:
+			return files
+		params = {'maxKeys': list_page, 'nextPageToken': listing['nextPageToken']}
+
+
+def download_file(filename, key_knmi):
 	endpoint = f"{api_url}/{api_version}/datasets/{dataset_name}/versions/{dataset_version}/files/{filename}/url"
-
-	folder = 'data/KNMI_Data'
-	if not os.path.exists(folder):	# check if folder exists
-	   os.makedirs(folder)	# make new folder
-
 	path = f'{folder}/{filename}'  # path that the file will be downloaded to
-	exists = os.path.exists(path)  # True if the file is already there, false if the file still needs to be downloaded
-
-	if exists:	# check if the file already exists
-		pass  # file exists, skip the download process
-	else:
-		get_file_response = requests.get(endpoint, headers={'Authorization': api_key})
+	with file_lock(filename):
+		if os.path.exists(path):  # downloaded by another window in the meantime
+			return
+		get_file_response = client.get(endpoint, 'knmi', headers={'Authorization': key_knmi})
 		if get_file_response.status_code != 200:  # check if status code is ok
 			print(get_file_response.status_code)
 			print(get_file_response.text)
 			print("Unable to retrieve KNMI download url for file. Adding zeroes")
-			
-			d = {'DR': [float("NAN")],  # calculate average irradiation in Drenthe
-				 'FL': [float("NAN")],
-				 'FR': [float("NAN")],
-				 'GD': [float("NAN")],
-				 'GR': [float("NAN")],
-				 'LB': [float("NAN")],
-				 'NB': [float("NAN")],
-				 'NH': [float("NAN")],
-				 'OV': [float("NAN")],
-				 'UT': [float("NAN")],
-				 'ZL': [float("NAN")],
-				 'ZH': [float("NAN")]}
-			dr = pd.DataFrame(data=d).astype(float)	 # saving average irradiation data per province to dataframe
-			return dr
-			
+			return
+
 		download_url = get_file_response.json().get("temporaryDownloadUrl")	 # fetch temporary download URL
 
 		try:
-			with requests.get(download_url, stream=True) as r:
+			with client.get(download_url, stream=True) as r:
 				r.raise_for_status()
-				with open(f'data/KNMI_Data/{filename}', "wb") as f:	# create new file in folder
+				with open(path + '.part', "wb") as f:	# write to a partial file first, so an interrupted download is not read later
 					for chunk in r.iter_content(chunk_size=8192):
 						f.write(chunk)	# write file per chunk
-		except Exception:
-			print("Unable to download KNMI weather file using download URL")
-			sys.exit(1)
-		print(f'Weather data   NL	{y2}-{m2}-{d2} {h2}:00')
-
-	ds = nc.Dataset(f'data/KNMI_Data/{filename}')  # Converting download .nc file into dataframe
-
-	if tech == 'pv':
-		var_name = 'qg'	 # qg is the name for the irradiation column in KNMI data
-	elif tech == 'wind':
-		var_name = 'ff'	 # ff is the name for the wind column in KNMI data
-	else:
-		print(f'Unkown technology given: {tech}. Type either pv or wind')
-
-	df = pd.DataFrame(columns=['stationname', 'q'])	 # creation empty dataframe
-	
-	for i in range(51):	 # include first 51 entries (52-54 are Dutch-caribbean weather stations)
-		try:
-			sn = ds['stationname'][i]  # reading station names
-			q = ds[var_name][i]	 # reading the irradiation/wind data from the dataframe
-			if str(q) == '[--]':  # filtering the empty entries
-				pass
+			os.replace(path + '.part', path)
+		except Exception as e:	# fail the window, so its days are fetched again by the next run
+			raise RuntimeError(f'Unable to download KNMI weather file {filename} using download URL') from e
+		print(f'Weather data   NL	{filename[26:30]}-{filename[30:32]}-{filename[32:34]} {filename[34:36]}:00')
+
+
+def read_stations(path):  # station table of one file: qg and ff per station, NaN where the station has no value
+	with nc_lock:
+		ds = nc.Dataset(path)
+		names = np.asarray(ds['stationname'][:51]).astype(str).ravel()	# include first 51 entries (52-54 are Dutch-caribbean weather stations)
+		columns = {}
+		for var_name in variables:
+			if var_name in ds.variables:
+				columns[var_name] = np.ma.filled(ds[var_name][:51].astype(float), np.nan).reshape(len(names), -1)[:, 0]
 			else:
-				df.loc[len(df)] = [sn, float(q)]
-		except:
-			pass
-
-	# Following lists show which weather stations are incorporated in the calculation of province averages
-	nh = ['DE KOOY VK', 'AMSTERDAM/SCHIPHOL AP', 'BERKHOUT AWS', 'WIJK AAN ZEE AWS']
-	zh = ['VOORSCHOTEN AWS', 'AMSTERDAM/SCHIPHOL AP', 'HOEK VAN HOLLAND AWS', 'ROTTERDAM THE HAGUE AP', 'CABAUW TOWER AWS']
-	zl = ['VLISSINGEN AWS', 'WESTDORPE AWS', 'WILHELMINADORP AWS', 'HOEK VAN HOLLAND AWS']
-	nb = ['GILZE RIJEN', 'HERWIJNEN AWS', 'EINDHOVEN AP', 'VOLKEL']
-	lb = ['ELL AWS', 'MAASTRICHT AACHEN AP', 'ARCEN AWS']
-	ut = ['AMSTERDAM/SCHIPHOL AP', 'DE BILT AWS', 'CABAUW TOWER AWS', 'HERWIJNEN AWS']
-	ov = ['MARKNESSE AWS', 'HEINO AWS', 'HOOGEVEEN AWS', 'HUPSEL AWS', 'TWENTHE AWS']
-	gd = ['LELYSTAD AP', 'DEELEN', 'HEINO AWS', 'HUPSEL AWS', 'HERWIJNEN AWS']
-	fl = ['STAVOREN AWS', 'LELYSTAD AP', 'MARKNESSE AWS']
-	dr = ['MARKNESSE AWS', 'HOOGEVEEN AWS', 'GRONINGEN AP EELDE', 'NIEUW BEERTA AWS']
-	fr = ['TERSCHELLING HOORN AWS', 'STAVOREN AWS', 'LEEUWARDEN', 'LAUWERSOOG AWS']
-	gr = ['LAUWERSOOG AWS', 'GRONINGEN AP EELDE', 'NIEUW BEERTA AWS']
-	# Filtering province selection
-	dfnh = df[df['stationname'].isin(nh)]  # create dataframe with irradiation data weather stations in Noord-Holland
-	dfzh = df[df['stationname'].isin(zh)]
-	dfzl = df[df['stationname'].isin(zl)]
-	dfnb = df[df['stationname'].isin(nb)]
-	dflb = df[df['stationname'].isin(lb)]
-	dfut = df[df['stationname'].isin(ut)]
-	dfov = df[df['stationname'].isin(ov)]
-	dfgd = df[df['stationname'].isin(gd)]
-	dffl = df[df['stationname'].isin(fl)]
-	dfdr = df[df['stationname'].isin(dr)]
-	dffr = df[df['stationname'].isin(fr)]
-	dfgr = df[df['stationname'].isin(gr)]
-	# Calculating averages
-	d = {'DR': [dfdr['q'].mean(axis=0)],  # calculate average irradiation in Drenthe
-		 'FL': [dffl['q'].mean(axis=0)],
-		 'FR': [dffr['q'].mean(axis=0)],
-		 'GD': [dfgd['q'].mean(axis=0)],
-		 'GR': [dfgr['q'].mean(axis=0)],
-		 'LB': [dflb['q'].mean(axis=0)],
-		 'NB': [dfnb['q'].mean(axis=0)],
-		 'NH': [dfnh['q'].mean(axis=0)],
-		 'OV': [dfov['q'].mean(axis=0)],
-		 'UT': [dfut['q'].mean(axis=0)],
-		 'ZL': [dfzl['q'].mean(axis=0)],
-		 'ZH': [dfzh['q'].mean(axis=0)]}
-
-	dr = pd.DataFrame(data=d).astype(float)	 # saving average irradiation data per province to dataframe
-	return dr
+				columns[var_name] = np.full(len(names), np.nan)
+		ds.close()
+	df = pd.DataFrame(columns, index=pd.Index(names, name='stationname'))
+	return df.groupby(level=0, sort=False).mean()	# one row per station
+
+
+def knmi_archive():	 # hours x (present, var:station) values, with one float32 array per month
+	return MonthlyStore(archive_folder, ['present'], decimals=None)
+
+
+def archived_hours(archive, start, end):  # hours from start to end that were taken from a file
+	if len(archive.days(start, end)) == 0:
+		return pd.DatetimeIndex([], tz='UTC')
+	present = archive.read(start, end)['present']
+	return present.index[present.notna()]
+
+
+def archive_files(archive, weather, filenames):	 # add the station values of the files to weather and store the changed days
+	new = {}
+	for filename in filenames:
+		table = read_stations(f'{folder}/{filename}')
+		row = {'present': 1.0}
+		for var_name in variables:
+			row.update({f'{var_name}:{station}': value for station, value in table[var_name].items()})
+		new[file_hour(filename)] = row
+	if len(new) == 0:
+		return weather
+	new = pd.DataFrame.from_dict(new, orient='index')
+	weather = weather.reindex(columns=weather.columns.union(new.columns, sort=False))
+	weather.loc[new.index, new.columns] = new.values
+	days = weather.index.normalize()
+	archive.write(weather[days.isin(new.index.normalize())])  # the store replaces whole days
+	return weather
+
+
+def read_weather(date, days=1):	# hours x (present, var:station) values of the window, files that are not archived yet are added
+	hours = hour_index(date, days)
+	with archive_lock:
+		archive = knmi_archive()
+		weather = archive.read(hours[0], hours[-1])
+		files = [knmi_filename(h) for h in weather.index[weather['present'].isna()] if os.path.exists(f'{folder}/{knmi_filename(h)}')]
+		weather = archive_files(archive, weather, files)	# each file is opened once for both pv and wind
+	return weather
+
+
+def compact_knmi(remove=True):	# archive all downloaded files, by default the files are removed afterwards
+	if not os.path.exists(folder):
+		return
+	files = sorted(f for f in os.listdir(folder) if f.startswith('KMDS__OPER_P___10M_OBS_L2_') and f.endswith('.nc'))
+	months = {}
+	for filename in files:
+		months.setdefault(filename[26:32], []).append(filename)
+	for month, month_files in months.items():	# one write per month
+		start = pd.Timestamp(f'{month[:4]}-{month[4:]}-01', tz='UTC')
+		end = start + pd.offsets.MonthEnd(0) + pd.Timedelta(hours=23)
+		with archive_lock:
+			archive = knmi_archive()
+			weather = archive.read(start, end)
+			archived = weather.index[weather['present'].notna()]
+			todo = [f for f in month_files if file_hour(f) not in archived]
+			archive_files(archive, weather, todo)
+		print(f'Weather data   NL	archived {len(todo)} files of {month[:4]}-{month[4:]}')
+		if remove:
+			for filename in month_files:
+				os.remove(f'{folder}/{filename}')
+
+
+def province_values(weather, var_name, hours):	# hours x provinces averages of a variable of the weather table
+	values = weather.reindex(index=hours, columns=[f'{var_name}:{station}' for station in stations]).to_numpy(dtype=float)  # hours x stations
+	reported = ~np.isnan(values)  # filtering the empty entries
+	with np.errstate(invalid='ignore', divide='ignore'):
+		prov = (np.where(reported, values, 0) @ weights) / (reported @ weights)	# NaN where no station of a province reported
+	return pd.DataFrame(prov, columns=provinces, index=hours)
+
+
+# model constants, per province in the order of provinces
+cap_onshore = np.array([222, 1351, 581, 171, 734, 72, 300, 668, 74, 34, 567, 535], dtype=float)  # capacity of onshore wind turbines in MW https://opendata.cbs.nl/#/CBS/nl/dataset/70960ned/table
+rot_onshore = np.array([847000, 3724000, 1951000, 608000, 2194000, 277000, 974000, 2129000, 230000, 131000, 1721000, 1640000], dtype=float)  # rotor area of onshore wind turbines in m2 https://opendata.cbs.nl/#/CBS/nl/dataset/70960ned/table
+
+air_density = 1.246	 # kg/m3
+turbine_efficiency = 0.26  # percentage of total wind power converted into electrical power
+measurement_height = 10	 # height at which wind speed is measured by KNMI
+average_hub_height = 119  # average height of wind turbine axis
+surface_roughness = 0.20  # Hellman exponent 0.10-0.25 for completely flat surface to urban environment respectively https://www.intechopen.com/chapters/17121
+ws_conversion_factor = mt.pow((average_hub_height / measurement_height), surface_roughness)
+cut_in_speed = 5  # speed at which turbine start to produce electricity in m/s
+cut_out_speed = 21	# speed at which turbine shuts off in m/s
+
+# installed PV capacity per province [MWp]
+cap_total = np.array([1065, 636, 948, 2240, 1233, 1318, 2991, 1624, 1465, 880, 670, 1785], dtype=float)
+cap_roof = np.array([512, 440, 696, 1881, 543, 1233, 2708, 1424, 1178, 792, 406, 1612], dtype=float)
+cap_field = np.array([553, 196, 252, 358, 689, 85, 282, 200, 288, 88, 264, 173], dtype=float)
+pv_n = 0.836  # 1 - all system and placement losses, 16.4 percent in calibration with cbs data
+
+# default model settings
+settings = {'debug_csv': False}	 # write the intermediate pv and wind frames to data/ for inspection
+
+
+def configure(odect_settings):
+	update_settings(settings, odect_settings)
+
+
+def wind_power(speed):	# hours x provinces wind speed at 10 m in m/s to electric power in MW
+	speed = speed * ws_conversion_factor  # wind speed at hub height
+	speed = np.where((speed >= cut_in_speed) & (speed <= cut_out_speed), speed, 0)	# replace values outside of cutin-cutout (and missing values) with zero
+	power = speed ** 3 * rot_onshore / 2 * air_density / 1000000	# wind power in MW
+	power = np.round(power * turbine_efficiency, 2)	 # converting MW of wind power into electric power
+	return np.clip(power, 0, cap_onshore)
+
+
+def pv_power(irradiation):	# hours x provinces irradiation in W/m2 to rooftop and field generation in MW
+	pvro = irradiation * cap_roof / 1000 * pv_n  # divide by 1000 W/m2 to get actual generation and account for losses
+	pvfi = irradiation * cap_field / 1000 * pv_n
+	return pvro, pvfi
+
+
+def fetch_wind(date, days=1, weather=None):  # weather is the table of read_weather, read from the archive if not given
+	if weather is None:
+		weather = read_weather(date, days)
+	hours = hour_index(date, days)	# hours of the window
+	wind_df = province_values(weather, 'ff', hours)	 # average wind speed per province
+	if settings['debug_csv']:
+		wind_df.to_csv('data/wind_df.csv')
+
+	wps = pd.DataFrame(index=hours)
+	wps['WDNS_NL'] = wind_power(wind_df.to_numpy()).sum(axis=1)
+	return wps
 
 
+def fetch_pv(date, days=1, weather=None):  # weather is the table of read_weather, read from the archive if not given
+	if weather is None:
+		weather = read_weather(date, days)
+	hours = hour_index(date, days)	# hours of the window
+	pv_irr = province_values(weather, 'qg', hours)	# average irradiation per province
+	pvro, pvfi = pv_power(pv_irr.to_numpy())
+	if settings['debug_csv']:
+		pv_irr.to_csv('data/pv_irr.csv')
+		pd.DataFrame(pvro, columns=provinces, index=hours).to_csv('data/pvro.csv')
+		pd.DataFrame(pvfi, columns=provinces, index=hours).to_csv('data/pvfi.csv')
+
+	df = pd.DataFrame(index=hours)
+	df['PVRO_NL'] = np.nansum(pvro, axis=1)  # sum generation over all provinces to obtain national generation
+	df['PVFI_NL'] = np.nansum(pvfi, axis=1)
+	return df
@@ -0,0 +1,148 @@
+# Copyright 2023 University of Twente
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# On-disk cache of raw API responses, so the databases can be rebuilt without downloading everything again
+
+import datetime as dt
+import pandas as pd
+import gzip
+import hashlib
+import json
+import os
+import requests
+import threading
+import time
+
+from lib import client
+from lib.config import update_settings
+
+folder = 'data/cache'  # kept when the data folder is pruned
+
+# default cache settings
+settings = {'cache_ttl': 1800,  # seconds before a response about the last 48 hours is revalidated
+            'cache_recent': 48}  # hours before now in which published data may still change
+
+secret_params = ['securityToken']  # request parameters that are not part of the cache key
+period_params = ('periodStart', 'periodEnd')  # request parameters of the period, set per window by get_days()
+
+
+def configure(odect_settings):
+    update_settings(settings, odect_settings)
+
+
+def fresh(meta, period_end):  # True if a cached response about a period ending at period_end can be used without revalidation
+    settled = period_end + dt.timedelta(hours=settings['cache_recent'])  # published data does not change anymore after this
+    if meta['fetched'] >= settled.timestamp():  # downloaded after the data settled, immutable
+        return True
+    return time.time() - meta['fetched'] < settings['cache_ttl']
+
+
+def cache_path(source, url, params):
+    key = {k: v for k, v in (params or {}).items() if k not in secret_params}
+    digest = hashlib.sha256(json.dumps([url, key], sort_keys=True).encode()).hexdigest()
+    return f'{folder}/{source}/{digest[:2]}/{digest}'
+
+
+def get(source, url, params=None, period_end=None, api=None, headers=None):  # response body from the cache, downloaded or revalidated when needed
+    path = cache_path(source, url, params)
+    meta = read_meta(path)
+    if meta is not None and (period_end is None or fresh(meta, period_end)):  # still fresh, without a period the response never changes
+        with gzip.open(path + '.gz', 'rb') as f:
+            return f.read()
+
+    headers = dict(headers or {})
+    if meta is not None:  # conditional request, the server only sends the body if it changed
+        if meta.get('etag') is not None:
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified') is not None:
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = client.get(url, api, params=params, headers=headers)
+    if response.status_code == 304 and meta is not None:  # not modified, keep the cached body
+        meta['fetched'] = time.time()
+        write_meta(path, meta)
+        with gzip.open(path + '.gz', 'rb') as f:
+            return f.read()
+    if response.status_code != 200:  # do not cache errors, the request fails so its window is fetched again by the next run
+        raise requests.HTTPError(f'{source} request returned {response.status_code}: {response.text[:300]}', response=response)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.gz.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:  # write to a temporary file first, so an interrupted run leaves no broken entry
+        f.write(gzip.compress(response.content, compresslevel=6))
+    os.replace(tmp, path + '.gz')
+    write_meta(path, {'url': url,
+                      'fetched': time.time(),
+                      'etag': response.headers.get('ETag'),
+                      'last_modified': response.headers.get('Last-Modified')})
+    return response.content
+
+
+def get_days(source, url, params, first, days, api=None, headers=None):  # (body, days) pairs covering the days of a window request
+    # Every day refers to the stored response of the window it was downloaded with, so windows of other sizes and
+    # offsets reuse the days that are cached already and only the days that are missing or outdated are requested
+    day_list = [first + pd.Timedelta(days=i) for i in range(days)]
+    paths = {}
+    for day in day_list:
+        day_path = cache_path(source, url, window_params(params, day, 1)) + '.day'
+        if os.path.exists(day_path):
+            with open(day_path) as f:
+                path = json.load(f)['path']
+            meta = read_meta(path)
+            if meta is not None and fresh(meta, day + pd.Timedelta(days=1)):
+                paths[day] = path
+
+    stale = [day for day in day_list if day not in paths]
+    if len(stale) > 0:  # one request from the first to the last day that is not cached
+        n = (stale[-1] - stale[0]).days + 1
+        w_params = window_params(params, stale[0], n)
+        get(source, url, w_params, stale[0] + pd.Timedelta(days=n), api, headers)
+        path = cache_path(source, url, w_params)
+        for i in range(n):
+            day = stale[0] + pd.Timedelta(days=i)
+            day_path = cache_path(source, url, window_params(params, day, 1)) + '.day'
+            tmp = f'{day_path}.{threading.get_ident()}.tmp'
+            os.makedirs(os.path.dirname(day_path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump({'path': path}, f)
+            os.replace(tmp, day_path)
+            paths[day] = path
+
+    parts = []  # read every stored response once
+    for path in sorted(set(paths.values())):
+        with gzip.open(path + '.gz', 'rb') as f:
+            body = f.read()
+        parts.append((body, [day for day in day_list if paths[day] == path]))
+    return parts
+
+
+def window_params(params, first, days):  # request parameters for the days from first on
+    params = dict(params)
+    params[period_params[0]] = first.strftime('%Y%m%d0000')
+    params[period_params[1]] = (first + pd.Timedelta(days=days)).strftime('%Y%m%d0000')
+    return params
+
+
+def read_meta(path):  # metadata of a stored response, None if it is not stored
+    if not (os.path.exists(path + '.json') and os.path.exists(path + '.gz')):
+        return None
+    with open(path + '.json') as f:
+        return json.load(f)
+
+
+def write_meta(path, meta):
+    tmp = f'{path}.json.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, path + '.json')
@@ -0,0 +1,130 @@
+# Copyright 2023 University of Twente
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Shared HTTP client for all fetchers: pooled keep-alive sessions, timeouts, retries and rate limiting per API
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+import random
+import threading
+import time
+
+from lib.config import update_settings
+
+# default client settings, see configure()
+settings = {'http_timeout': 60,  # seconds to wait for a connection or response
+            'http_retries': 5,  # retries on connection errors, 429 and 5xx responses
+            'http_backoff': 1.0,  # base of the exponential backoff in seconds
+            'http_pool': 16,  # keep-alive connections per host
+            'rate_entsoe': 400,  # requests per minute, the ENTSO-e quota per security token
+            'rate_knmi': 50}  # requests per minute, the KNMI quota for anonymous keys
+
+retry_status = [429, 500, 502, 503, 504]
+
+sessions = {}  # one session per host, so connections are reused between requests
+limiters = {}  # one rate limiter per API
+lock = threading.Lock()
+
+
+class RateLimiter():
+    def __init__(self, rate, per=60.0):  # token bucket allowing at most rate requests in any period
+        # a burst of a tenth of the rate, the bucket refills with the rest, so a full bucket plus one period of refill stays within rate
+        self.capacity = max(1.0, float(rate) // 10)
+        self.tokens = self.capacity
+        self.fill_rate = max(float(rate) - self.capacity, 1.0) / per
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):  # block until a request may be sent
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.fill_rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+def configure(odect_settings):  # new sessions and rate limiters are created with the new settings
+    with lock:
+        update_settings(settings, odect_settings)
+        limiters.clear()
+        sessions.clear()
+
+
+def session(url):
+    host = urlsplit(url).netloc
+    with lock:
+        if host not in sessions:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings['http_pool'])
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            sessions[host] = s
+        return sessions[host]
+
+
+def limiter(api):
+    if api is None or settings.get(f'rate_{api}') is None:  # no quota known for this API
+        return None
+    with lock:
+        if api not in limiters:
+            limiters[api] = RateLimiter(settings[f'rate_{api}'])
+        return limiters[api]
+
+
+def backoff(attempt):  # exponential backoff with full jitter, so parallel workers do not retry in lockstep
+    return random.uniform(0, settings['http_backoff'] * (2 ** attempt))
+
+
+def request(method, url, api=None, **kwargs):
+    kwargs.setdefault('timeout', settings['http_timeout'])
+    s = session(url)
+    rl = limiter(api)
+    retries = settings['http_retries']
+    for attempt in range(retries + 1):
+        if rl is not None:
+            rl.acquire()
+        try:
+            response = s.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            wait = backoff(attempt)
+            print(f'WARNING: Request to {urlsplit(url).netloc} failed ({e.__class__.__name__}), retrying in {wait:.1f}s')
+            time.sleep(wait)
+            continue
+        if response.status_code in retry_status and attempt < retries:
+            wait = backoff(attempt)
+            try:  # honour the wait time requested by the server
+                wait = max(wait, float(response.headers.get('Retry-After')))
+            except (TypeError, ValueError):
+                pass
+            print(f'WARNING: Request to {urlsplit(url).netloc} returned {response.status_code}, retrying in {wait:.1f}s')
+            response.close()
+            time.sleep(wait)
+            continue
+        return response
+
+
+def get(url, api=None, **kwargs):
+    return request('GET', url, api, **kwargs)
+
+
+def post(url, api=None, **kwargs):
+    return request('POST', url, api, **kwargs)
@@ -0,0 +1,21 @@
+# Copyright 2023 University of Twente
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Settings of the modules, taken over from settings/config.py
+
+
+def update_settings(defaults, odect_settings):  # overwrite the keys of a settings dict that the ODECT config contains, the others keep their default
+    for key in defaults:
+        if key in odect_settings:
+            defaults[key] = odect_settings[key]
@@ -0,0 +1,151 @@
+# Copyright 2023 University of Twente
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Emissions engine: generation per type, emissions and AEF as matrix products on the generation database columns
+
+import pandas as pd
+import numpy as np
+import hashlib
+
+ef_file = 'settings/Emission_Factors.csv'
+scenario_file = 'settings/Emission_Factor_Scenarios.csv'  # alternative factor sets, one row per scenario
+model_version = 1  # increase when the calculation changes, so cached results are calculated again
+
+# generation types with an emission factor, the 20 ENTSO-e types plus the types modelled for the Netherlands
+gen_types = ['BIOD', 'LIGN', 'COAG', 'CCGT', 'COAL', 'OILS', 'SHAL', 'PEAT', 'GEOT', 'HYPS', 'HYRR', 'HYRS', 'TIDE', 'NUCL', 'OTHR', 'PVUT', 'WSTE', 'WDOF', 'WDON', 'OTHE', 'PVFI_NL', 'PVRO_NL', 'WDNS_NL']
+
+# output categories and the generation types they combine
+output_groups = {'Biomass': ['BIOD'],
+                 'Lignite': ['LIGN'],
+                 'Gasified Coal': ['COAG'],
+                 'Natural gas': ['CCGT'],
+                 'Coal': ['COAL'],
+                 'Oil products': ['OILS'],
+                 'Shale gas': ['SHAL'],
+                 'Peat': ['PEAT'],
+                 'Geothermal': ['GEOT'],
+                 'Ocean energy': ['TIDE'],
+                 'Nuclear': ['NUCL'],
+                 'Other Renewable': ['OTHR'],
+                 'Waste': ['WSTE'],
+                 'Wind Offshore': ['WDOF'],
+                 'Other Fossil': ['OTHE'],
+                 'PV': ['PVUT', 'PVFI_NL', 'PVRO_NL'],
+                 'Hydropower': ['HYPS', 'HYRR', 'HYRS'],
+                 'Wind Onshore': ['WDON', 'WDNS_NL']}
+output_columns = list(output_groups.keys())
+
+
+def read_factors(filename=ef_file):  # emission factors in gCO2eq/kWh as a vector in the order of gen_types
+    ef = pd.read_csv(filename)
+    return ef[gen_types].to_numpy(dtype=float)[0]
+
+
+def read_scenarios(filename=scenario_file):  # scenario names and the scenarios x gen_types factor matrix
+    sc = pd.read_csv(filename)
+    return list(sc['scenario']), sc[gen_types].to_numpy(dtype=float)
+
+
+def factor_hash(ef):  # short hash of an emission factor vector, part of the key of cached results
+    return hashlib.sha256(np.asarray(ef, dtype=float).tobytes()).hexdigest()[:16]
+
+
+def sample_factors(factors, samples, seed=None):  # Monte Carlo factor sets, per type triangular between the lowest, median and highest scenario
+    low = factors.min(axis=0)
+    mode = np.median(factors, axis=0)
+    high = factors.max(axis=0)
+    rng = np.random.default_rng(seed)
+    wide = high > low  # the triangular distribution needs a range, other types keep their factor
+    out = np.tile(mode, (samples, 1))
+    out[:, wide] = rng.triangular(low[wide], mode[wide], high[wide], size=(samples, int(wide.sum())))
+    return out
+
+
+def column_type(column):  # generation type of a database column, None for columns such as total_NL
+    if column in gen_types:
+        return column
+    prefix = column.split('_')[0]
+    if prefix in gen_types:
+        return prefix
+    return None
+
+
+def aggregation_matrix(columns):  # columns x gen_types matrix that sums the database columns per generation type
+    agg = np.zeros((len(columns), len(gen_types)))
+    for i, column in enumerate(columns):
+        gen_type = column_type(column)
+        if gen_type is not None:
+            agg[i, gen_types.index(gen_type)] = 1
+    return agg
+
+
+def output_matrix():  # gen_types x output_columns matrix that combines the types into the output categories
+    out = np.zeros((len(gen_types), len(output_columns)))
+    for j, name in enumerate(output_columns):
+        for gen_type in output_groups[name]:
+            out[gen_types.index(gen_type), j] = 1
+    return out
+
+
+class EmissionModel():
+    def __init__(self, columns, ef=None):  # compile the matrices once for the columns of the generation data
+        if ef is None:
+            ef = read_factors()
+        self.columns = list(columns)
+        self.ef = np.asarray(ef, dtype=float)
+        self.agg = aggregation_matrix(self.columns)  # columns x types
+        self.out = output_matrix()  # types x outputs
+        self.gen_out = self.agg @ self.out  # columns x outputs, generation per output category
+        self.em_out = (self.agg * self.ef) @ self.out  # columns x outputs, emissions per output category
+        self.em_total = self.agg @ self.ef  # emissions per MW of every column
+        self.gen_total = self.agg.sum(axis=1)  # 1 for columns with a generation type, 0 otherwise
+
+    def values(self, gen):  # hours x columns array of a frame or array, missing values count as zero
+        if isinstance(gen, pd.DataFrame):
+            gen = gen[self.columns].to_numpy(dtype=float)
+        return np.nan_to_num(gen)
+
+    def generation(self, gen):  # hours x gen_types generation in MW
+        return self.values(gen) @ self.agg
+
+    def shares(self, gen):  # hours x gen_types fraction of the total generation
+        g = self.generation(gen)
+        total = g.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total != 0, g / total, 0)
+
+    def aef(self, gen):  # AEF in gCO2eq/kWh per hour, 0 for hours without generation
+        x = self.values(gen)
+        total = x @ self.gen_total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total != 0, (x @ self.em_total) / total, 0)
+
+    def scenario_aef(self, gen, factors):  # hours x scenarios AEF for a scenarios x gen_types factor matrix, all scenarios at once
+        g = self.generation(gen)
+        total = g.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total != 0, (g @ np.asarray(factors, dtype=float).T) / total, 0)
+
+    def bands(self, gen, factors, percentiles=(5, 50, 95)):  # hours x percentiles of the AEF over the factor sets
+        return np.percentile(self.scenario_aef(gen, factors), percentiles, axis=1).T
+
+    def frames(self, gen):  # aef, emissions and generation frames of a generation frame, indexed like it
+        x = self.values(gen)
+        total = x @ self.gen_total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            aef = np.where(total != 0, (x @ self.em_total) / total, 0)
+        aef = pd.DataFrame({'aef': aef}, index=gen.index)
+        em = pd.DataFrame(x @ self.em_out, columns=output_columns, index=gen.index)
+        gen = pd.DataFrame(x @ self.gen_out, columns=output_columns, index=gen.index)
+        return aef, em, gen
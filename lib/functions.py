@@ -15,181 +15,218 @@
 # import packages
 import pandas as pd
 import numpy as np
-from datetime import datetime
-import datetime as dt
 import plotly.graph_objects as go
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # import fetch functions
-from lib.ENTSOE import fetch_generation, fetch_import
+from lib.store import MonthlyStore
+from lib.emissions import EmissionModel, read_factors, read_scenarios, sample_factors, factor_hash, model_version
+from lib.results import ResultStore, result_key
+from lib.ENTSOE import fetch_generation, fetch_import, import_zones, period_breaks
 from lib.GB import fetch_gb_generation
-from lib.KNMI import fetch_pv, fetch_wind
+from lib.KNMI import download_knmi, read_weather, fetch_pv, fetch_wind
 
+database_folder = 'data/generation'  # generation database, one file per month
+legacy_file = 'data/Database_Generation_Alt.csv'  # former csv database, still used for import and export
+commit_days = 30  # fetched days are written to the database in batches of at least this many days
 
-def aef(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi):
-    ef = pd.read_csv('settings/Emission_Factors.csv')  # read emission factors
-    gen_i = fetch_gen(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi)  # collect generation data
+# columns of the generation database, in the order of Database_Generation_Alt.csv
+gen_columns = ['BIOD_NL', 'LIGN_NL', 'COAG_NL', 'CCGT_NL', 'COAL_NL', 'OILS_NL', 'SHAL_NL', 'PEAT_NL', 'GEOT_NL', 'HYPS_NL', 'HYRR_NL', 'HYRS_NL', 'TIDE_NL', 'NUCL_NL', 'OTHR_NL', 'WSTE_NL', 'WDOF_NL', 'OTHE_NL', 'total_NL',
+              'BIOD_DE', 'LIGN_DE', 'COAG_DE', 'CCGT_DE', 'COAL_DE', 'OILS_DE', 'SHAL_DE', 'PEAT_DE', 'GEOT_DE', 'HYPS_DE', 'HYRR_DE', 'HYRS_DE', 'TIDE_DE', 'NUCL_DE', 'OTHR_DE', 'PVUT_DE', 'WSTE_DE', 'WDOF_DE', 'WDON_DE', 'OTHE_DE',
+              'BIOD_BE', 'LIGN_BE', 'COAG_BE', 'CCGT_BE', 'COAL_BE', 'OILS_BE', 'SHAL_BE', 'PEAT_BE', 'GEOT_BE', 'HYPS_BE', 'HYRR_BE', 'HYRS_BE', 'TIDE_BE', 'NUCL_BE', 'OTHR_BE', 'PVUT_BE', 'WSTE_BE', 'WDOF_BE', 'WDON_BE', 'OTHE_BE',
+              'BIOD_NO', 'LIGN_NO', 'COAG_NO', 'CCGT_NO', 'COAL_NO', 'OILS_NO', 'SHAL_NO', 'PEAT_NO', 'GEOT_NO', 'HYPS_NO', 'HYRR_NO', 'HYRS_NO', 'TIDE_NO', 'NUCL_NO', 'OTHR_NO', 'PVUT_NO', 'WSTE_NO', 'WDOF_NO', 'WDON_NO', 'OTHE_NO',
+              'BIOD_DK', 'LIGN_DK', 'COAG_DK', 'CCGT_DK', 'COAL_DK', 'OILS_DK', 'SHAL_DK', 'PEAT_DK', 'GEOT_DK', 'HYPS_DK', 'HYRR_DK', 'HYRS_DK', 'TIDE_DK', 'NUCL_DK', 'OTHR_DK', 'PVUT_DK', 'WSTE_DK', 'WDOF_DK', 'WDON_DK', 'OTHE_DK',
+              'CCGT_GB', 'COAL_GB', 'NUCL_GB', 'WDON_GB', 'HYRS_GB', 'BIOD_GB', 'OTHR_GB', 'PVUT_GB',
+              'PVRO_NL', 'WDNS_NL', 'PVFI_NL']
 
-    gen = pd.DataFrame()
-    gen_list = ['BIOD', 'LIGN', 'COAG', 'CCGT', 'COAL', 'OILS', 'SHAL', 'PEAT', 'GEOT', 'HYPS', 'HYRR', 'HYRS', 'TIDE', 'NUCL', 'OTHR', 'PVUT', 'WSTE', 'WDOF', 'WDON', 'OTHE', 'PVFI_NL', 'PVRO_NL', 'WDNS_NL']
-    for gen_type in gen_list:
-        gen[gen_type] = gen_i.filter(regex=gen_type).sum(axis=1)
 
-    em = calc_em(gen, ef)  # calculate emission data
+def aef(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers=1, window=1):  # AEF, emission and generation frames of the whole range
+    chunks = list(aef_chunks(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers, window))
+    aef_list, em, gen = (pd.concat(frames) for frames in zip(*chunks))
+    return aef_list, em, gen
 
-    aef_list = calc_aef(gen, em)  # calculate Average Emission Factor data
 
-    s_date = dt.datetime(int(s_y), int(s_m), int(s_d), tzinfo=dt.timezone.utc)  # encode start datetime
-    e_date = dt.datetime(int(e_y), int(e_m), int(e_d), tzinfo=dt.timezone.utc)  # encode end datetime
-    date = s_date  # set initial value of date variable
-    date_list = []  # make empty list
-    for i in range(1, (int((e_date-s_date).days)+1)*24+1):  # for all days between start date and end date
-        date_list.append(date.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))  # add date to date_list
-        date = date + dt.timedelta(hours=1)  # add 1 day to date variable
+def aef_chunks(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers=1, window=1, refresh=None):  # (aef, em, gen) per calendar month, so long ranges run in bounded memory
+    results = ResultStore()
+    ef = read_factors()
+    ef_hash = factor_hash(ef)
+    model = None
+    for s_date, e_date in month_chunks(s_y, s_m, s_d, e_y, e_m, e_d):
+        store = update_range(s_date, e_date, key_entsoe, key_knmi, workers, window, refresh)  # collect generation data
+        e_hour = e_date + pd.Timedelta(hours=23)
+        days = pd.date_range(s_date, e_date, freq='D').strftime('%Y-%m-%d')
+        keys = {day: result_key(store.day_revision(day), ef_hash, model_version) for day in days}  # inputs of every day
+        fresh = results.fresh(keys)
+        stale = [day for day in days if day not in fresh]  # days without results for their current inputs
+        if len(stale) > 0:
+            print(f'Calculating emissions for {len(stale)} day(s) of {s_date:%Y-%m}, {len(fresh)} day(s) from the result cache')
+            gen = store.read(s_date, e_hour)
+            gen = gen[gen.index.strftime('%Y-%m-%d').isin(stale)]
+            if model is None:
+                model = EmissionModel(gen.columns, ef)  # aggregation and emission factor matrices for the database columns
+            aef, em, gen = model.frames(gen)  # calculate AEF, emission and generation data per output category
+            results.write(aef, em, gen, {day: keys[day] for day in stale})
+        yield results.read(s_date, e_hour)
+
+
+def aef_scenarios(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers=1, window=1, samples=1000, percentiles=(5, 50, 95)):
+    return pd.concat(aef_scenario_chunks(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers, window, samples, percentiles))
+
+
+def aef_scenario_chunks(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers=1, window=1, samples=1000, percentiles=(5, 50, 95)):
+    names, factors = read_scenarios()
+    mc = sample_factors(factors, samples) if samples > 0 else None  # the same Monte Carlo samples for every month
+    model = None
+    for s_date, e_date in month_chunks(s_y, s_m, s_d, e_y, e_m, e_d):
+        gen = fetch_range(s_date, e_date, key_entsoe, key_knmi, workers, window)  # stored days are read from the database
+        if model is None:
+            model = EmissionModel(gen.columns, read_factors())
+        result = pd.DataFrame(model.scenario_aef(gen, factors), columns=names, index=gen.index)  # AEF per scenario
+        if mc is not None:  # percentile bands of the AEF over Monte Carlo samples of the factors
+            bands = model.bands(gen, mc, percentiles)
+            for j, p in enumerate(percentiles):
+                result[f'p{p}'] = bands[:, j]
+        yield result
+
+
+def month_chunks(s_y, s_m, s_d, e_y, e_m, e_d):  # (first day, last day) of every calendar month in the range
+    s_date = pd.Timestamp(int(s_y), int(s_m), int(s_d), tz='UTC')  # encode start datetime
+    e_date = pd.Timestamp(int(e_y), int(e_m), int(e_d), tz='UTC')  # encode end datetime
+    while s_date <= e_date:
+        end = min(s_date + pd.offsets.MonthEnd(0), e_date)
+        yield s_date, end
+        s_date = end + pd.Timedelta(days=1)
+
+
+def fetch_gen(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi, workers=1, window=1):
+    s_date = pd.Timestamp(int(s_y), int(s_m), int(s_d), tz='UTC')  # encode start datetime
+    e_date = pd.Timestamp(int(e_y), int(e_m), int(e_d), tz='UTC')  # encode end datetime
+    return fetch_range(s_date, e_date, key_entsoe, key_knmi, workers, window)
+
+
+def fetch_range(s_date, e_date, key_entsoe, key_knmi, workers=1, window=1):  # generation data of all hours from the first to the last day
+    store = update_range(s_date, e_date, key_entsoe, key_knmi, workers, window)
+    gen = store.read(s_date, e_date + pd.Timedelta(hours=23))  # read only the months of the queried dates
+    return gen
 
-    # refactor dataframes before returning
-    aef_list['datetime'] = date_list
-    aef_list = aef_list.set_index('datetime')
 
-    rename_list = {'BIOD': 'Biomass', 'LIGN': 'Lignite', 'COAG': 'Gasified Coal', 'CCGT': 'Natural gas', 'COAL': 'Coal', 'OILS': 'Oil products', 'SHAL': 'Shale gas', 'PEAT': 'Peat', 'GEOT': 'Geothermal', 'TIDE': 'Ocean energy', 'NUCL': 'Nuclear', 'OTHR': 'Other Renewable', 'WSTE': 'Waste', 'WDOF': 'Wind Offshore', 'WDON': 'Wind Onshore Imp', 'OTHE': 'Other Fossil', 'WDNS_NL': 'Wind Onshore NL'}
+def update_range(s_date, e_date, key_entsoe, key_knmi, workers=1, window=1, refresh=None):  # fetch the days from the first to the last day that are not stored yet, returns the store
+    # days from refresh onwards are fetched again even if they are stored, as their data may still be published
+    store = generation_store()
+    date_list = pd.date_range(s_date, e_date, freq='D')  # all days between start date and end date
 
-    gen['datetime'] = date_list
-    gen = gen.set_index('datetime')
-    gen = finalise_df(gen, rename_list)
+    present = store.days(s_date, e_date)  # days in the queried range that are already stored
+    missing = []  # dates that still need to be fetched
+    for date in date_list:
+        if refresh is not None and date >= refresh:
+            print(f'Refreshing online data for {date:%Y-%m-%d %H:%M}')
+            missing.append(date)
+        elif date in present:  # check if selected date is present in the database
+            print(f'{date:%Y-%m-%d %H:%M} is present in database')
+        else:
+            print(f'Fetching online data for {date:%Y-%m-%d %H:%M}')
+            missing.append(date)
 
-    em['datetime'] = date_list
-    em = em.set_index('datetime')
-    em = finalise_df(em, rename_list)
+    if len(missing) > 0:
+        windows = date_windows(missing, window)  # fetch consecutive days with one request per source
+        # windows are independent, so fetch them concurrently with a bounded number of workers
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as pool:
+            futures = [pool.submit(fetch_data, date, key_entsoe, key_knmi, days) for date, days in windows]
 
-    return aef_list, em, gen
+            for (date, days), future in zip(windows, futures):  # collect the results in date order
+                try:
+                    store.append(future.result().round(1))  # round the values on 1 decimal, as in the former csv database
+                except Exception as e:
+                    print(f'WARNING: Fetching data for {date:%Y-%m-%d} ({days} day(s)) failed: {e}')
+                    error = e
+                if store.buffered_days() >= commit_days:  # commit regularly, so a crash during a long backfill loses little
+                    store.commit()
 
+        store.commit()  # store the days that were fetched successfully, even if others failed
 
-def fetch_gen(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi):
-    database_file = 'data/Database_Generation_Alt.csv'
-    exists = os.path.exists(database_file)
-
-    if exists:  # Check if Database_Generation.csv is present
-        pass  # Do nothing
-    else:
-        dbgen = pd.DataFrame(columns=['datetime',  # Make new Database_Generation.csv
-                                      'BIOD_NL', 'LIGN_NL', 'COAG_NL', 'CCGT_NL', 'COAL_NL', 'OILS_NL', 'SHAL_NL', 'PEAT_NL', 'GEOT_NL', 'HYPS_NL', 'HYRR_NL', 'HYRS_NL', 'TIDE_NL', 'NUCL_NL', 'OTHR_NL', 'WSTE_NL', 'WDOF_NL', 'OTHE_NL', 'total_NL',
-                                      'BIOD_DE', 'LIGN_DE', 'COAG_DE', 'CCGT_DE', 'COAL_DE', 'OILS_DE', 'SHAL_DE', 'PEAT_DE', 'GEOT_DE', 'HYPS_DE', 'HYRR_DE', 'HYRS_DE', 'TIDE_DE', 'NUCL_DE', 'OTHR_DE', 'PVUT_DE', 'WSTE_DE', 'WDOF_DE', 'WDON_DE', 'OTHE_DE',
-                                      'BIOD_BE', 'LIGN_BE', 'COAG_BE', 'CCGT_BE', 'COAL_BE', 'OILS_BE', 'SHAL_BE', 'PEAT_BE', 'GEOT_BE', 'HYPS_BE', 'HYRR_BE', 'HYRS_BE', 'TIDE_BE', 'NUCL_BE', 'OTHR_BE', 'PVUT_BE', 'WSTE_BE', 'WDOF_BE', 'WDON_BE', 'OTHE_BE',
-                                      'BIOD_NO', 'LIGN_NO', 'COAG_NO', 'CCGT_NO', 'COAL_NO', 'OILS_NO', 'SHAL_NO', 'PEAT_NO', 'GEOT_NO', 'HYPS_NO', 'HYRR_NO', 'HYRS_NO', 'TIDE_NO', 'NUCL_NO', 'OTHR_NO', 'PVUT_NO', 'WSTE_NO', 'WDOF_NO', 'WDON_NO', 'OTHE_NO',
-                                      'BIOD_DK', 'LIGN_DK', 'COAG_DK', 'CCGT_DK', 'COAL_DK', 'OILS_DK', 'SHAL_DK', 'PEAT_DK', 'GEOT_DK', 'HYPS_DK', 'HYRR_DK', 'HYRS_DK', 'TIDE_DK', 'NUCL_DK', 'OTHR_DK', 'PVUT_DK', 'WSTE_DK', 'WDOF_DK', 'WDON_DK', 'OTHE_DK',
-                                      'CCGT_GB', 'COAL_GB', 'NUCL_GB', 'WDON_GB', 'HYRS_GB', 'BIOD_GB', 'OTHR_GB', 'PVUT_GB',
-                                      'PVRO_NL', 'WDNS_NL', 'PVFI_NL'])
-        dbgen.to_csv(database_file)  # Save new Database_Generation.csv
-
-    gen = pd.read_csv(database_file)  # read generation data
-    s_date = dt.datetime(int(s_y), int(s_m), int(s_d), tzinfo=dt.timezone.utc)  # encode start datetime
-    e_date = dt.datetime(int(e_y), int(e_m), int(e_d), tzinfo=dt.timezone.utc)  # encode end datetime
-    date = s_date  # set initial value of date variable
-    date_list = []  # make empty list
-    for i in range(1, int((e_date-s_date).days)+2):  # for all days between start date and end date
-        date_list.append(date.astimezone(dt.timezone.utc).strftime('%Y-%m-%d %H:%M'))  # add date to date_list
-        date = date + dt.timedelta(days=1)  # add 1 day to date variable
+        if error is not None:
+            raise error
 
-    for date in date_list:
-        if date in gen['datetime'].values:  # check if selected date is present in csv
-            print(f'{date} is present in database')
-        else:
-            print(f'Fetching online data for {date}')
-            new_data = fetch_data(date, key_entsoe, key_knmi)  # collect new data from APIs
-            gen = gen.set_index('datetime')
-            gen = pd.concat([gen, new_data])  # append GEN with new_data
-            gen = gen.reset_index()
-            gen = gen.sort_values(by=['datetime'])  # sort the generation database on date
-            gen = gen.round(1)  # round the database values on 1 decimal to limit file size
-            gen = gen[gen.columns.drop(list(gen.filter(regex='Unnamed')))]
-            gen.to_csv(database_file)  # save the new generation database to csv
-
-    gen = gen[gen.datetime.between(f'{s_y}-{s_m}-{s_d} 00:00', f'{e_y}-{e_m}-{e_d} 23:00')]  # select queried dates from gen
-    return gen
-
-
-def fetch_data(date, key_entsoe, key_knmi):
-    i = fetch_import(date, key_entsoe)  # collect import data from ENTSOe
-
-    g_nl = fetch_generation(date, '10YNL----------L', key_entsoe)  # collect NL generation data from ENTSOe
-    g_nl = g_nl.add_suffix('_NL')  # add '_NL' tag to column names of NL generation
-    g_nl['total_NL'] = np.sum(g_nl, axis=1)
-    gen = g_nl
-
-    g_de = fetch_generation(date, '10Y1001A1001A82H', key_entsoe)  # germany
-    g_de = g_de.add_suffix('_DE')
-    g_de_total = np.sum(g_de, axis=1)  # calculate total generation per time slot
-    g_de = g_de.div(g_de_total, axis='rows')  # divide generation data by total generation to get fractional generation
-    im_de = i['im_DE']  # create database with German import data
-    g_de = g_de.mul(im_de, axis='rows')  # multiply the relative generation with import to obtain absolute import per type
-    gen = gen.join(g_de)  # add German data to generation dataframe
-
-    g_be = fetch_generation(date, '10YBE----------2', key_entsoe)  # belgium
-    g_be = g_be.add_suffix('_BE')
-    g_be_total = np.sum(g_be, axis=1)
-    g_be = g_be.div(g_be_total, axis='rows')  # divide generation data by total generation to get fractional generation
-    im_be = i['im_BE']
-    g_be = g_be.mul(im_be, axis='rows')
-    gen = gen.join(g_be)
-
-    g_no = fetch_generation(date, '10YNO-2--------T', key_entsoe)  # norway
-    g_no = g_no.add_suffix('_NO')
-    g_no_total = np.sum(g_no, axis=1)
-    g_no = g_no.div(g_no_total, axis='rows')  # divide generation data by total generation to get fractional generation
-    im_no = i['im_NO']
-    g_no = g_no.mul(im_no, axis='rows')
-    gen = gen.join(g_no)
-
-    if 'im_DK' in i:
-        g_dk = fetch_generation(date, '10YDK-1--------W', key_entsoe)  # denmark
-        g_dk = g_dk.add_suffix('_DK')
-        g_dk_total = np.sum(g_dk, axis=1)
-        g_dk = g_dk.div(g_dk_total, axis='rows')  # divide generation data by total generation to get fractional generation
-        im_dk = i['im_DK']
-        g_dk = g_dk.mul(im_dk, axis='rows')
-        gen = gen.join(g_dk)
-
-    g_gb = fetch_gb_generation(date)
-    im_gb = i['im_GB']
-    # CHECK IF IMPORT DATA GB IS CORRECTLY PROCESSED
-    g_gb = g_gb.mul(im_gb, axis='rows')
-    gen = gen.join(g_gb)
-
-    gen = gen.drop(['WDON_NL', 'PVUT_NL'], axis=1)  # drop the ENTSO-e PV and onshore wind data for NL zone because these are modelled manually
-
-    print(f'Fetching PV Data for {date}')
-    p = fetch_pv(date, key_knmi)  # collect PV generation data from KNMI
-    gen = gen.join(p)
-    
-    print(f'Fetching wind Data for {date}')
-    w = fetch_wind(date, key_knmi)  # collect onshore wind generation data from KNMI
-    gen = gen.join(w)
+    return store
 
-    return gen
 
+def generation_store():  # the generation database, partitioned per month
+    store = MonthlyStore(database_folder, gen_columns)
+    if store.empty() and os.path.exists(legacy_file):  # take over the data of the former csv database once
+        print(f'Importing {legacy_file} into {database_folder}')
+        store.import_csv(legacy_file)
+    return store
 
-def calc_em(gen, ef):
-    col = gen.columns  # read GEN column names
-    em = pd.DataFrame()  # create empty dataframe EM
-    em[col] = np.multiply(gen[col], ef[col].values[:1])  # multiply GEN columns with EF values to obtain emission data
-    return em
 
+def export_gen(filename=legacy_file):  # write the generation database to csv, in the format of the former database
+    generation_store().export_csv(filename)
 
-def calc_aef(gen, em):
-    gen_agg = np.sum(gen, axis=1)  # calculate total generation per time slot
-    aef_type = em.div(gen_agg, axis='rows')  # calculate contribution to AEF per type
-    aef_list = pd.DataFrame()
-    aef_list['aef'] = np.sum(aef_type, axis=1)  # calculate AEF per time slot
-    return aef_list
 
+def date_windows(date_list, window):  # group consecutive dates into (first date, number of days) windows
+    windows = []
+    for date in date_list:
+        if len(windows) > 0:
+            first, days = windows[-1]
+            # extend the last window if date follows it directly and no zone or resolution change lies in between
+            if first + pd.Timedelta(days=days) == date and days < window and date not in period_breaks:
+                windows[-1] = (first, days + 1)
+                continue
+        windows.append((date, 1))
+    return windows
+
+
+# import zones whose generation mix is scaled by the import from that zone
+import_list = {'DE': '10Y1001A1001A82H',  # germany
+               'BE': '10YBE----------2',  # belgium
+               'NO': '10YNO-2--------T',  # norway
+               'DK': '10YDK-1--------W'}  # denmark
+
+
+def fetch_data(date, key_entsoe, key_knmi, days=1):  # fetch the generation mix for a window of days starting at date
+    # all sources are independent, only the scaling of the import zones has to wait for the import data
+    zones = import_zones(date, days)  # zones with import data available in the window
+    with ThreadPoolExecutor(max_workers=len(import_list)+5) as pool:
+        f_i = pool.submit(fetch_import, date, key_entsoe, days)  # collect import data from ENTSOe
+        f_nl = pool.submit(fetch_generation, date, '10YNL----------L', key_entsoe, days)  # collect NL generation data from ENTSOe
+        f_zones = {}
+        for country, zone_code in import_list.items():
+            if zone_code in zones:
+                f_zones[country] = pool.submit(fetch_generation, date, zone_code, key_entsoe, days)
+        f_gb = pool.submit(fetch_gb_generation, date, days)
+        print(f'Fetching PV and wind Data for {date:%Y-%m-%d %H:%M} ({days} day(s))')
+        f_k = pool.submit(download_knmi, date, key_knmi, days)  # download the weather files of the window from KNMI
+
+        g_nl = f_nl.result()
+        g_nl = g_nl.add_suffix('_NL')  # add '_NL' tag to column names of NL generation
+        g_nl['total_NL'] = np.sum(g_nl, axis=1)
+        gen = g_nl
+
+        i = f_i.result()  # the scaling below depends on the import data
+        for country, f_g in f_zones.items():
+            g = f_g.result()
+            g = g.add_suffix(f'_{country}')
+            g_total = np.sum(g, axis=1)  # calculate total generation per time slot
+            g = g.div(g_total, axis='rows')  # divide generation data by total generation to get fractional generation
+            im = i[f'im_{country}']  # create database with import data of this zone
+            g = g.mul(im, axis='rows')  # multiply the relative generation with import to obtain absolute import per type
+            gen = gen.join(g)  # add data of this zone to generation dataframe
+
+        g_gb = f_gb.result()
+        im_gb = i['im_GB']
+        # CHECK IF IMPORT DATA GB IS CORRECTLY PROCESSED
+        g_gb = g_gb.mul(im_gb, axis='rows')
+        gen = gen.join(g_gb)
+
+        gen = gen.drop(['WDON_NL', 'PVUT_NL'], axis=1)  # drop the ENTSO-e PV and onshore wind data for NL zone because these are modelled manually
+
+        f_k.result()  # PV and wind are modelled from the downloaded files
+        weather = read_weather(date, days)  # read every file once for both models
+        gen = gen.join(fetch_pv(date, days, weather))  # collect PV generation data from KNMI
+        gen = gen.join(fetch_wind(date, days, weather))  # collect onshore wind generation data from KNMI
 
-def finalise_df(df, rlist):  # adapt dataframes for figure creation
-    df = df.rename(columns=rlist)
-    df['PV'] = df.filter(regex='PV').sum(axis=1)
-    df['Hydropower'] = df.filter(regex='HY').sum(axis=1)
-    df['Wind Onshore'] = df.filter(regex='Onshore').sum(axis=1)
-    df = df.drop(columns=['PVUT', 'PVRO_NL', 'PVFI_NL', 'Wind Onshore NL', 'Wind Onshore Imp', 'HYRR', 'HYPS', 'HYRS'])
-    return df
+    return gen
 
 
 def figure(df, title, subtitle, ytitle):  # make a figure from dataframe
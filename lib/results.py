@@ -0,0 +1,60 @@
+# Copyright 2023 University of Twente
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cache of calculated AEF, emissions and generation per day, reused as long as the inputs of a day do not change
+
+import numpy as np
+import json
+import os
+
+from lib.store import MonthlyStore
+from lib.emissions import output_columns
+
+results_folder = 'data/results'  # one file per month, like the generation database
+
+result_columns = ['aef'] + [f'em:{c}' for c in output_columns] + [f'gen:{c}' for c in output_columns]
+
+
+class ResultStore():
+    def __init__(self, folder=results_folder):
+        self.store = MonthlyStore(folder, result_columns, decimals=None, dtype=np.float64)  # results are kept at full precision
+        self.keys_file = f'{folder}/keys.json'
+        self.keys = {}  # per day the key of the inputs its results were calculated from
+        if os.path.exists(self.keys_file):
+            with open(self.keys_file) as f:
+                self.keys = json.load(f)
+
+    def fresh(self, keys):  # days of a {day: key} dict whose stored results were calculated from the same inputs
+        return set(day for day, key in keys.items() if key is not None and self.keys.get(day) == key and self.store.has_day(day))
+
+    def write(self, aef, em, gen, keys):  # store the results of whole days and the keys of their inputs
+        df = aef[['aef']].join(em.add_prefix('em:')).join(gen.add_prefix('gen:'))
+        self.store.write(df)
+        self.keys.update(keys)  # keys are only saved once the results are on disk, so an interrupted run calculates the days again
+        with open(self.keys_file + '.tmp', 'w') as f:
+            json.dump(self.keys, f)
+        os.replace(self.keys_file + '.tmp', self.keys_file)
+
+    def read(self, start, end):  # aef, emission and generation frames of all hours from start to end
+        df = self.store.read(start, end)
+        aef = df[['aef']]
+        em = df[[f'em:{c}' for c in output_columns]].set_axis(output_columns, axis=1)
+        gen = df[[f'gen:{c}' for c in output_columns]].set_axis(output_columns, axis=1)
+        return aef, em, gen
+
+
+def result_key(revision, ef_hash, model_version):  # key of the inputs of a day, None if the day has no generation data
+    if revision is None:
+        return None
+    return f'{revision}:{ef_hash}:{model_version}'
@@ -0,0 +1,211 @@
+# Copyright 2023 University of Twente
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Hourly data stored per month as a float32 array with one row per column, memory-mapped when read or updated
+
+import pandas as pd
+import numpy as np
+import json
+import os
+
+
+class MonthlyStore():
+    def __init__(self, folder, columns, decimals=1, dtype=np.float32):
+        self.folder = folder
+        self.decimals = decimals  # values are rounded when read, None keeps the stored precision
+        self.dtype = dtype
+        self.manifest_file = f'{folder}/manifest.json'
+        os.makedirs(folder, exist_ok=True)
+        self.buffer = []  # frames appended since the last commit
+        manifest = {'columns': []}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+        self.columns = manifest['columns']
+        self.revision = manifest.get('revision', 0)  # counter of the writes to the store
+        self.revisions = manifest.get('revisions', {})  # per day the write that last changed it
+        if 'days' in manifest:
+            self.index = set(manifest['days'])  # stored days, so presence checks do not touch the data
+        else:  # manifest of an older version, build the index once from the data
+            self.index = set()
+            for month in self.months():
+                index = pd.date_range(month + '-01', periods=hours_in_month(month), freq='h')
+                self.index |= self.scan_days(index)
+            self.save_manifest()
+        self.add_columns(columns)
+
+    def empty(self):  # True if no month has been stored yet
+        return len(self.months()) == 0
+
+    def months(self):
+        return sorted(f[:-4] for f in os.listdir(self.folder) if f.endswith('.npy'))
+
+    def add_columns(self, columns):  # columns are only appended, so older partitions stay valid for the first columns
+        new = [c for c in columns if c not in self.columns]
+        if len(new) > 0 or not os.path.exists(self.manifest_file):
+            self.columns = self.columns + new
+            self.save_manifest()
+
+    def save_manifest(self):
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            json.dump({'columns': self.columns, 'days': sorted(self.index), 'revision': self.revision, 'revisions': self.revisions}, f)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    def partition(self, month):  # memory-mapped array of a month, None if the month is not stored
+        path = f'{self.folder}/{month}.npy'
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def read(self, start, end):  # all hours from start to end (inclusive), reading only the months in that range
+        hours = pd.date_range(utc(start), utc(end), freq='h', name='datetime')
+        index = hours.tz_convert(None)
+        out = np.full((len(self.columns), len(index)), np.nan, dtype=self.dtype)
+        for month, rows, pos in month_slices(index):
+            arr = self.partition(month)
+            if arr is not None:
+                out[:arr.shape[0], pos] = arr[:, rows]
+        df = pd.DataFrame(out.T.astype(float), columns=self.columns)
+        if self.decimals is not None:
+            df = df.round(self.decimals)
+        df.index = hours
+        return df
+
+    def has_day(self, date):
+        return utc(date).strftime('%Y-%m-%d') in self.index
+
+    def day_revision(self, date):  # revision of the data of a day, None if the day is not stored
+        day = utc(date).strftime('%Y-%m-%d')
+        if day not in self.index:
+            return None
+        return self.revisions.get(day, 0)  # days stored before revisions were kept share revision 0
+
+    def append(self, df):  # buffer a frame with a datetime index, it is stored by the next commit
+        self.buffer.append(df)
+
+    def buffered_days(self):
+        return sum(len(df) for df in self.buffer) // 24
+
+    def commit(self):  # store all buffered frames with one write per month
+        if len(self.buffer) > 0:
+            self.write(pd.concat(self.buffer))
+            self.buffer = []
+
+    def write(self, df):  # store a frame with a datetime index, replacing all values of the days it contains
+        self.add_columns(list(df.columns))
+        index = utc(pd.to_datetime(df.index)).tz_convert(None)  # the months are laid out in UTC hours
+        cols = [self.columns.index(c) for c in df.columns]
+        values = df.to_numpy(dtype=self.dtype).T
+        days = index.normalize().unique()
+        rewritten = set(days.strftime('%Y-%m-%d')) & self.index
+        if len(rewritten) > 0:  # unlist the days that are updated in place until they are written completely
+            self.index -= rewritten
+            self.save_manifest()
+        for month, rows, pos in month_slices(index):
+            path = f'{self.folder}/{month}.npy'
+            arr = self.partition(month)
+            if arr is not None and arr.shape[0] == len(self.columns):  # update the stored month in place
+                arr = np.load(path, mmap_mode='r+')
+                replace = False
+            elif arr is not None:  # columns were added after this month was written, extend it
+                arr = np.vstack([arr, np.full((len(self.columns) - arr.shape[0], arr.shape[1]), np.nan, dtype=self.dtype)])
+                replace = True
+            else:
+                arr = np.full((len(self.columns), hours_in_month(month)), np.nan, dtype=self.dtype)
+                replace = True
+            first = pd.Timestamp(month + '-01')
+            for day in days[days.strftime('%Y-%m') == month]:  # clear the days that are rewritten
+                h = int((day - first) / pd.Timedelta(hours=1))
+                arr[:, h:h+24] = np.nan
+            arr[np.ix_(cols, rows)] = values[:, pos]
+            if replace:
+                with open(path + '.tmp', 'wb') as f:  # write to a temporary file first, so an interrupted run leaves no broken month
+                    np.save(f, arr)
+                os.replace(path + '.tmp', path)
+            else:
+                arr.flush()
+            del arr
+        # days are only added to the index once their data is on disk, so an interrupted run fetches them again
+        written = self.scan_days(index, df)
+        self.index |= written
+        self.revision += 1
+        for day in sorted(written):
+            self.revisions[day] = self.revision
+        self.save_manifest()
+
+    def days(self, start, end):  # days from start to end that hold data
+        dates = pd.date_range(utc(start).normalize(), utc(end), freq='D')
+        return set(d for d in dates if d.strftime('%Y-%m-%d') in self.index)
+
+    def scan_days(self, index, df=None):  # days of index with at least one value, read from df or from the stored months
+        present = np.zeros(len(index), dtype=bool)
+        if df is not None:
+            present = ~df.isna().all(axis=1).to_numpy()
+        else:
+            for month, rows, pos in month_slices(index):
+                arr = self.partition(month)
+                if arr is not None:
+                    present[pos] = ~np.isnan(arr[:, rows]).all(axis=0)
+        found = pd.Series(present, index=index).groupby(index.normalize()).any()
+        return set(found.index[found.values].strftime('%Y-%m-%d'))
+
+    def import_csv(self, filename):  # load a CSV with a datetime column, such as the former Database_Generation_Alt.csv
+        df = pd.read_csv(filename)
+        df = df[df.columns.drop(list(df.filter(regex='Unnamed')))]
+        df = df.set_index('datetime')
+        if len(df) > 0:
+            self.write(df)
+
+    def export_csv(self, filename, start=None, end=None):  # write the stored data to CSV, by default all months
+        months = self.months()
+        if len(months) == 0:
+            return
+        if start is None:
+            start = months[0] + '-01 00:00'
+        if end is None:
+            end = (pd.Timestamp(months[-1] + '-01') + pd.offsets.MonthEnd(0)).strftime('%Y-%m-%d 23:00')
+        df = self.read(start, end)
+        df = df[~df.isna().all(axis=1)]  # skip hours without data
+        df.index = df.index.strftime('%Y-%m-%d %H:%M')
+        df.to_csv(filename)
+
+
+def utc(date):  # timestamp or index in UTC, naive values are taken as UTC
+    if isinstance(date, str):
+        date = pd.Timestamp(date)
+    if date.tz is None:
+        return date.tz_localize('UTC')
+    return date.tz_convert('UTC')
+
+
+def hour_index(date, days=1):  # the full hours of a window of days starting at date, the time axis of all data
+    return pd.date_range(utc(date), periods=24 * days, freq='h', name='datetime')
+
+
+def epoch_seconds(index):  # UTC timestamps in seconds of a datetime index
+    return utc(pd.DatetimeIndex(index)).tz_convert(None).to_numpy().astype('datetime64[s]').astype(np.int64)
+
+
+def hours_in_month(month):
+    first = pd.Timestamp(month + '-01')
+    return int(((first + pd.offsets.MonthBegin(1)) - first) / pd.Timedelta(hours=1))
+
+
+def month_slices(index):  # per month: the month, the hour offsets within the month and the positions in index
+    months = index.strftime('%Y-%m')
+    for month in months.unique():
+        pos = np.flatnonzero(months == month)
+        first = pd.Timestamp(month + '-01')
+        rows = ((index[pos] - first) / pd.Timedelta(hours=1)).astype(int)
+        yield month, np.asarray(rows), pos
@@ -14,10 +14,13 @@
 
 import pandas as pd
 from json import loads, dumps
-import os, argparse, requests, shutil, datetime, time
+import os, argparse, requests, shutil, datetime, time, tempfile
 
-from lib.functions import aef, figure
-from tools.influx_writer import InfluxDBWriter
+from lib.functions import aef_chunks, aef_scenario_chunks, figure, export_gen
+from lib import KNMI
+from tools.influx_writer import InfluxDBBatchWriter
+from tools.influx_export import result_lines, ExportState, write_import_file
+from lib import client, cache
 
 # Import the config
 try:
@@ -32,231 +35,286 @@ try:
 except:
 	print("No valid config found! Please rename the config.py.example file to config.py and enter yourt API keys")
 	exit()
-	
 
+client.configure(odect_settings)	# timeouts, retries and rate limits for all HTTP requests
+cache.configure(odect_settings)		# revalidation of cached responses
+KNMI.configure(odect_settings)		# PV and wind model options
 
+folder = 'data/'
 
-#Get arguments:
-parser = argparse.ArgumentParser()
-parser.add_argument('-s', '--start') 
-parser.add_argument('-e', '--end') 
-parser.add_argument('-g', '--graphs', action='store_true') 
-parser.add_argument('-j', '--json', action='store_true') 
-parser.add_argument('-d', '--database', action='store_true') 
-parser.add_argument('--prune', action='store_true') 
+def parse_args():
+	#Get arguments:
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-s', '--start') 
+	parser.add_argument('-e', '--end') 
+	parser.add_argument('-g', '--graphs', action='store_true') 
+	parser.add_argument('-j', '--json', action='store_true') 
+	parser.add_argument('-d', '--database', action='store_true') 
+	parser.add_argument('--prune', action='store_true') 
+	parser.add_argument('-c', '--csv', action='store_true') 
+	parser.add_argument('-k', '--compact', action='store_true') 
+	parser.add_argument('--scenarios', action='store_true') 
+	parser.add_argument('-o', '--output', action='store_true') 
+	parser.add_argument('-b', '--bulk', action='store_true') 
+	parser.add_argument('--daemon', action='store_true') 
+	return parser.parse_args()
 
 
-#Parse and check initial arguments
-args = parser.parse_args()
+def date_args(args):	# start and end date as (s_y, s_m, s_d, e_y, e_m, e_d)
+	# Check date input if it exists:
+	if args.start is not None or args.end is not None:
+		if args.start is None or args.end is None or len(args.start)!=8 or len(args.end)!=8:
+			print("ODECT needs a start date and end date in format YYYYMMDD to run")
+			exit()
 
-# Check date input if it exists:
-if args.start is not None or args.end is not None:
-	if len(args.start)!=8 or len(args.end)!=8:
-		print("ODECT needs a start date and end date in format YYYYMMDD to run")
-		exit()
+		try:
+			int(args.start)
+			int(args.end)
+		except:
+			print("ODECT needs a start date and end date in format YYYYMMDD to run")
+			exit()
 
-	try:
-		int(args.start)
-		int(args.end)
-	except:
-		print("ODECT needs a start date and end date in format YYYYMMDD to run")
-		exit()
-
-	if int(args.start) > int(args.end):
-		print("ODECT needs a start date and end date in format YYYYMMDD to run")
-		exit()
-
-	# define start date (Due to daily publication of weather data, the model works up to yesterday)
-	s_y = args.start[0:4]  	# year (yy)
-	s_m = args.start[4:6]  	# month (mm)
-	s_d = args.start[6:8]  	# day (dd)
-	# define end date
-	e_y = args.end[0:4]  	# year (yy)
-	e_m = args.end[4:6]  	# month (mm)
-	e_d = args.end[6:8]  	# day (dd)
-
-# If dates not specified, then we take the last n days by default
-else:
-	# Start
-	date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=odect_settings['n_days'])	 # decode date as datetime
-	s_y = date.strftime(f'%Y')  # select year
-	s_m = date.strftime(f'%m')  # select month
-	s_d = date.strftime(f'%d')  # select day
-
-	# End
-	date = datetime.datetime.now(datetime.timezone.utc) # decode date as datetime
-	e_y = date.strftime(f'%Y')  # select year
-	e_m = date.strftime(f'%m')  # select month
-	e_d = date.strftime(f'%d')  # select day
-
-
-# Clear the data folder if specified
-folder = 'data/'
-if args.prune:
+		if int(args.start) > int(args.end):
+			print("ODECT needs a start date and end date in format YYYYMMDD to run")
+			exit()
+
+		# define start date (Due to daily publication of weather data, the model works up to yesterday)
+		s_y = args.start[0:4]  	# year (yy)
+		s_m = args.start[4:6]  	# month (mm)
+		s_d = args.start[6:8]  	# day (dd)
+		# define end date
+		e_y = args.end[0:4]  	# year (yy)
+		e_m = args.end[4:6]  	# month (mm)
+		e_d = args.end[6:8]  	# day (dd)
+
+	# If dates not specified, then we take the last n days by default
+	else:
+		# Start
+		date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=odect_settings['n_days'])	 # decode date as datetime
+		s_y = date.strftime(f'%Y')  # select year
+		s_m = date.strftime(f'%m')  # select month
+		s_d = date.strftime(f'%d')  # select day
+
+		# End
+		date = datetime.datetime.now(datetime.timezone.utc) # decode date as datetime
+		e_y = date.strftime(f'%Y')  # select year
+		e_m = date.strftime(f'%m')  # select month
+		e_d = date.strftime(f'%d')  # select day
+
+	return s_y, s_m, s_d, e_y, e_m, e_d
+
+
+def prune():	# clear the data folder
 	if not os.path.exists(folder):	# check if folder exists
 		os.makedirs(folder)	# make new folde
 		
 	# Clear all files, but do not delete folder
 	for root, dirs, files in os.walk('data'):
+		if root == 'data':
+			dirs[:] = [d for d in dirs if d != 'cache']	# keep the raw response cache, so the data can be rebuilt without downloading it again
 		for f in files:
 			os.unlink(os.path.join(root, f))
 		for d in dirs:
 			shutil.rmtree(os.path.join(root, d))
 
 
-# Create folder to store data
-if not os.path.exists(folder):	# check if folder exists
-	os.makedirs(folder)	# make new folde
+def labelled(df):	# frame with the hours formatted as text, for output only
+	return df.set_axis(df.index.strftime('%Y-%m-%d %H:%M'))
 
 
-# Running ODECT
+# Sinks receive the results month by month through write() and finish in close()
+class FigureSink():
+	def __init__(self):
+		self.chunks = []	# the graphs need the whole range, so only this sink keeps all months
 
+	def write(self, aef, em, gen):
+		self.chunks.append((aef, em, gen))
 
-# Obtain the data
-aef, em, gen = aef(s_y, s_m, s_d, e_y, e_m, e_d, key_entsoe, key_knmi)
+	def close(self):
+		if len(self.chunks) == 0:	# the run failed before the first month
+			return
+		aef, em, gen = (pd.concat(frames) for frames in zip(*self.chunks))
+		figure(aef, f'Dynamic Emission Intensity', 'Greenhouse gas emission intensity of the Dutch electricity mix', 'gCO2eq/kWh')
+		figure(em, f'Dynamic Emissions', 'Generation weighted life-cycle emissions per generation type', 'kgCO2eq')
+		figure(gen, f'Dynamic Generation', 'Electrical power generation per generation type', 'MW')
 
 
-# Create the output
-# Plot graphs if specified
-if args.graphs:
-	figure(aef, f'Dynamic Emission Intensity', 'Greenhouse gas emission intensity of the Dutch electricity mix', 'gCO2eq/kWh')
-	figure(em, f'Dynamic Emissions', 'Generation weighted life-cycle emissions per generation type', 'kgCO2eq')
-	figure(gen, f'Dynamic Generation', 'Electrical power generation per generation type', 'MW')
-	
-	
-# Dump JSON output if specified
-if args.json:
-	print(dumps(loads(aef.to_json()), indent=4))
-	print(dumps(loads(gen.to_json()), indent=4))
-	
+class CsvSink():
+	def __init__(self):
+		self.files = {'aef': f'{folder}AEF.csv', 'em': f'{folder}Emissions.csv', 'gen': f'{folder}Generation.csv'}
+		self.first = True
 
-# Write to datacase if specified
-if args.database:
-	# Connect to the database
-	db = InfluxDBWriter(influx_db, influx_host, influx_port)
-	# db.clearDatabase()
-	db.createDatabase()
-	
-	res = ['Other Renewable', 'Wind Offshore', 'PV', 'Hydropower', 'Wind Onshore', 'Geothermal', "Ocean energy"]
-	
-	# Retrieve the data
-	# First we store the data for CO2 in general
-	data = loads(aef.to_json())
-	for date, value in data['aef'].items():
-		# Prepare the data
-		measurement = "co2"
-		tags = {'country': 'NL', 'type': 'AEF'}
-		values = {'co2': float(value)}
-		
-		# Get the UTC timestamp
-		ts = int(datetime.datetime.timestamp(datetime.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')))
-		
-		if int(time.time())-1800 > ts:
-			# Send the data to the cache
-			db.appendValue(measurement, tags, values, ts)
-			
-			# Write to the database as it will be caching anyway
-			db.writeData()
-		
-	# Force a last flush
-	db.writeData(True)
-	
-	
-	
-	# Then we store the EM per generator
-	data = loads(em.to_json())
-	for g in data.keys():
-		for date, value in data[g].items():
-			# Prepare the data
-			measurement = "co2"
-			if g in res:
-				tags = {'country': 'NL', 'pollution': 'no', 'type': 'generators', 'generator': g.replace(" ", "_")}
-			else:
-				tags = {'country': 'NL', 'pollution': 'yes', 'type': 'generators', 'generator': g.replace(" ", "_")}
-			values = {'co2': float(value)}
-			
-			# Get the UTC timestamp
-			ts = int(datetime.datetime.timestamp(datetime.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')))
-			
-			if int(time.time())-1800 > ts:
-				# Send the data to the cache
-				db.appendValue(measurement, tags, values, ts)
-				
-				# Write to the database as it will be caching anyway
-				db.writeData()
-				
-		# Force a last flush
-		db.writeData(True)
-		
-		
-	# Then we store the MWh per generator
-	data = loads(gen.to_json())
-	for g in data.keys():
-		for date, value in data[g].items():
-			# Prepare the data
-			measurement = "co2"
-			if g in res:
-				tags = {'country': 'NL', 'pollution': 'no', 'type': 'generators', 'generator': g.replace(" ", "_")}
-			else:
-				tags = {'country': 'NL', 'pollution': 'yes', 'type': 'generators', 'generator': g.replace(" ", "_")}
-			values = {'MWh': float(value)}
-			
-			# Get the UTC timestamp
-			ts = int(datetime.datetime.timestamp(datetime.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')))
-			
-			if int(time.time())-1800 > ts:
-				# Send the data to the cache
-				db.appendValue(measurement, tags, values, ts)
-				
-				# Write to the database as it will be caching anyway
-				db.writeData()
-				
-		# Force a last flush
-		db.writeData(True)
-
-
-	# Lastly we determine the percentage and total MWh of renewables:
-	# Renewables:
-	total_d = {}
-	res_d = {}
-	
-	# Collecting the data
-	data = loads(gen.to_json())
-	for g in data.keys():
-		for date, value in data[g].items():
-			ts = int(datetime.datetime.timestamp(datetime.datetime.strptime(date+"+00:00", '%Y-%m-%d %H:%M%z')))
+	def write(self, aef, em, gen):
+		for key, df in (('aef', aef), ('em', em), ('gen', gen)):
+			labelled(df).to_csv(self.files[key], mode='w' if self.first else 'a', header=self.first, index_label='datetime')
+		self.first = False
+
+	def close(self):
+		pass
+
+
+class JsonSink():	# the same two documents as json.dumps(..., indent=4) of the whole frames, printed once the whole range is done
+	def __init__(self):
+		# the months are spooled to temporary files, so the progress messages of later months do not end up inside the documents
+		self.aef = tempfile.TemporaryFile('w+')
+		self.gen = tempfile.TemporaryFile('w+')
+
+	def write(self, aef, em, gen):
+		self.aef.write(labelled(aef).to_json() + '\n')
+		self.gen.write(labelled(gen).to_json() + '\n')
+
+	def close(self):
+		print_spooled(self.aef)
+		print_spooled(self.gen)
+
+
+def print_spooled(spool):	# print a spool of frames in JSON, one line per month, as a single document
+	spool.seek(0)
+	first = spool.readline()
+	columns = list(loads(first).keys()) if len(first) > 0 else []
+	print('{' if len(columns) > 0 else '{}')
+	for i, g in enumerate(columns):	# one pass over the spooled months per column
+		spool.seek(0)
+		entries = 0
+		for line in spool:
+			for date, value in loads(line)[g].items():
+				print(('    ' + dumps(g) + ': {\n' if entries == 0 else ',\n') + '        ' + dumps(date) + ': ' + dumps(value), end='')
+				entries += 1
+		end = ',' if i < len(columns) - 1 else ''
+		print('\n    }' + end if entries > 0 else '    ' + dumps(g) + ': {}' + end)
+	if len(columns) > 0:
+		print('}')
+	spool.close()
+
+
+class InfluxSink():
+	def __init__(self):
+		# Connect to the database, the lines are written in the background while the next month is calculated
+		self.db = InfluxDBBatchWriter(influx_db, influx_host, influx_port, f'{folder}influx_spool.lp')
+		self.state = ExportState(f'{folder}influx_state.json')	# what earlier runs have written
+		# self.db.clearDatabase()
+		self.db.createDatabase()	# before the first lines, so the spool of an earlier run is replayed into an existing database
+
+	def write(self, aef, em, gen):
+		# Only the hours up to half an hour ago, skipping the hours that were written before and did not change
+		until = int(time.time())-1800
+		write = self.state.changed(aef, em, gen, until)
+		self.db.appendLines(result_lines(aef[write], em[write], gen[write], until))
 		
-			# create counters
-			if ts not in total_d:
-				total_d[ts] = 0.0
-			if ts not in res_d:
-				res_d[ts] = 0.0
-				
-			if g in res:
-				res_d[ts] += float(value)
-			total_d[ts] += float(value)
-
-	for date, value in res_d.items():
-		# Calulcate the fraction
+		# Hand the month over to the writer
+		self.db.writeData(True)
+
+	def close(self):
+		# Wait until all lines are written or spooled, then remember what was exported
+		self.db.close()
+		self.state.save()
+
+
+class BulkSink():	# InfluxDB import files per month, for loading long ranges without the HTTP API
+	def __init__(self):
+		self.folder = f'{folder}influx/'
+		os.makedirs(self.folder, exist_ok=True)
+
+	def write(self, aef, em, gen):
+		# The chunks are whole months, except at the start and end of the range, so the name holds the first and last day of the file
+		first, last = aef.index[0].strftime('%Y%m%d'), aef.index[-1].strftime('%Y%m%d')
+		write_import_file(f'{self.folder}{influx_db}_{first}_{last}.lp.gz', influx_db, result_lines(aef, em, gen, int(time.time())-1800))
+
+	def close(self):
+		pass
+
+
+def run(args, refresh=None):	# refresh: first day that is fetched again even if it is stored
+	dates = date_args(args)
+	workers = odect_settings.get('n_workers', 4)
+	window = odect_settings.get('n_window', 7)
+
+	# Clear the data folder if specified
+	if args.prune:
+		prune()
+
+	# Create folder to store data
+	if not os.path.exists(folder):	# check if folder exists
+		os.makedirs(folder)	# make new folde
+
+
+	# Running ODECT
+	# The range is processed per month, every sink receives the results of a month as soon as they are ready
+	sinks = []
+	try:
+		if args.graphs:		# Plot graphs if specified
+			sinks.append(FigureSink())
+		if args.output:		# Write csv files if specified
+			sinks.append(CsvSink())
+		if args.json:		# Dump JSON output if specified
+			sinks.append(JsonSink())
+		if args.database:	# Write to datacase if specified
+			sinks.append(InfluxSink())
+		if args.bulk:		# Write InfluxDB import files if specified
+			sinks.append(BulkSink())
+
+		for aef, em, gen in aef_chunks(*dates, key_entsoe, key_knmi, workers, window, refresh):
+			for sink in sinks:
+				sink.write(aef, em, gen)
+	finally:	# also when a month fails, so the months before it are written and the Influx writer thread stops
+		for sink in sinks:
+			sink.close()
+
+
+	# Evaluate the emission factor scenarios if specified
+	if args.scenarios:
+		chunks = []
+		first = True
+		for scenarios in aef_scenario_chunks(*dates, key_entsoe, key_knmi, workers, window, odect_settings.get('n_samples', 1000)):
+			labelled(scenarios).to_csv(f'{folder}AEF_Scenarios.csv', mode='w' if first else 'a', header=first, index_label='datetime')
+			first = False
+			if args.graphs:
+				chunks.append(scenarios)
+		if args.graphs:
+			figure(pd.concat(chunks), f'Emission Intensity Scenarios', 'AEF per emission factor scenario and Monte Carlo percentiles', 'gCO2eq/kWh')
+
+
+	# Export the generation database to csv if specified
+	if args.csv:
+		export_gen()
+
+
+	# Archive the downloaded KNMI files and remove them if specified
+	if args.compact:
+		KNMI.compact_knmi()
+
+
+def daemon(args):
+	# Run every hour at minute 40 in one process, so the imports, HTTP sessions and parsed data stay in memory between runs
+	date_args(args)	# check the dates once, a wrong date stops the daemon instead of failing every run
+
+	if args.prune:	# only clear the data folder at the start
+		prune()
+		args.prune = False
+
+	while True:
+		start = datetime.datetime.now(datetime.timezone.utc)
+		# Instead of pruning, the days that may still be published are fetched again. The window reaches one day further,
+		# so the last download of a day is made after its data settled and stays in the cache for good
+		refresh = pd.Timestamp(start - datetime.timedelta(hours=cache.settings['cache_recent'])).normalize() - pd.Timedelta(days=1)
+		print(f'Running ODECT at {start:%Y-%m-%d %H:%M}')
 		try:
-			frac = (float(value)/float(total_d[date]))*100
-		except:
-			frac = 0
-		
-		# Prepare the data
-		measurement = "co2"
-		tags = {'country': 'NL', 'type': 'renewables'}
-		values = {'MWh': float(value), 'percentage': frac}
-		
-		# Get the UTC timestamp
-		ts = date
-		
-		if int(time.time())-1800 > ts:
-			# Send the data to the cache
-			db.appendValue(measurement, tags, values, ts)
-			
-			# Write to the database as it will be caching anyway
-			db.writeData()
-			
-	# Force a last flush
-	db.writeData(True)
\ No newline at end of file
+			run(args, refresh)
+		except (Exception, SystemExit) as e:	# keep running, the next run tries again
+			print(f'WARNING: ODECT run failed: {e!r}')
+
+		# The next run starts at the next minute 40 after this run finished, so runs never overlap
+		now = datetime.datetime.now(datetime.timezone.utc)
+		tick = now.replace(minute=40, second=0, microsecond=0)
+		if tick <= now:
+			tick += datetime.timedelta(hours=1)
+		print(f'Finished ODECT run, next run at {tick:%Y-%m-%d %H:%M}')
+		time.sleep((tick - now).total_seconds())
+
+
+if __name__ == '__main__':
+	args = parse_args()
+	if args.daemon:
+		daemon(args)
+	else:
+		run(args)
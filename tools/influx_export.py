@@ -0,0 +1,113 @@
+# Copyright 2023 Gerwin Hoogsteen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Line protocol of whole result frames, built per column instead of per point
+
+import numpy as np
+import gzip
+import hashlib
+import json
+import os
+
+from lib.store import epoch_seconds
+
+# generation types without direct emissions
+renewables = ['Other Renewable', 'Wind Offshore', 'PV', 'Hydropower', 'Wind Onshore', 'Geothermal', "Ocean energy"]
+
+
+def generator_tags(g):	# measurement and tags of the points of a generation type
+	pollution = 'no' if g in renewables else 'yes'
+	return f'co2,country=NL,pollution={pollution},type=generators,generator={g.replace(" ", "_")}'
+
+
+def text(values):	# values as an object array of str, so lines can be joined with numpy operators
+	return np.asarray(values, dtype=float).astype(str).astype(object)
+
+
+def series_lines(prefix, field, values, times):	# one line per hour of a series
+	return prefix + f' {field}=' + text(values) + times
+
+
+def result_lines(aef, em, gen, until=None):	# lines of the aef, emission and generation frames, optionally only hours before the timestamp until
+	ts = epoch_seconds(aef.index)
+	keep = np.ones(len(ts), dtype=bool) if until is None else ts < until
+	times = ' ' + ts[keep].astype(str).astype(object)	# timestamps in seconds, the precision the database is written with
+
+	blocks = [series_lines('co2,country=NL,type=AEF', 'co2', aef['aef'].to_numpy()[keep], times)]
+	for g in em.columns:
+		blocks.append(series_lines(generator_tags(g), 'co2', em[g].to_numpy()[keep], times))
+	for g in gen.columns:
+		blocks.append(series_lines(generator_tags(g), 'MWh', gen[g].to_numpy()[keep], times))
+
+	# total MWh and percentage of renewables
+	values = gen.to_numpy(dtype=float)[keep]
+	total = values.sum(axis=1)
+	res = values[:, gen.columns.isin(renewables)].sum(axis=1)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		frac = np.where(total != 0, res / total * 100, 0)
+	blocks.append('co2,country=NL,type=renewables MWh=' + text(res) + ',percentage=' + text(frac) + times)
+
+	return np.concatenate(blocks)
+
+
+def write_import_file(filename, database, lines):	# gzip-compressed file for `influx -import -compressed -precision=s`
+	with gzip.open(filename + '.tmp', 'wt', compresslevel=6) as f:	# write to a temporary file first, so an interrupted run leaves no broken file
+		f.write('# DDL\n')
+		f.write(f'CREATE DATABASE {database}\n')
+		f.write('# DML\n')
+		f.write(f'# CONTEXT-DATABASE: {database}\n')
+		if len(lines) > 0:
+			f.write('\n'.join(lines) + '\n')
+	os.replace(filename + '.tmp', filename)
+
+
+class ExportState():
+	# Watermark and content hash per day of the exported points, so a run only writes new hours and days that changed
+	def __init__(self, filename):
+		self.filename = filename
+		self.watermark = None	# timestamp of the last exported hour
+		self.days = {}			# per day the hash of its hours up to the watermark
+		if os.path.exists(filename):
+			with open(filename) as f:
+				state = json.load(f)
+			self.watermark = state['watermark']
+			self.days = state['days']
+
+	def changed(self, aef, em, gen, until):	# mask of the hours before until that still have to be written
+		ts = epoch_seconds(aef.index)
+		values = np.hstack([aef.to_numpy(dtype=float), em.to_numpy(dtype=float), gen.to_numpy(dtype=float)])
+		exported = ts < until
+		if not exported.any():
+			return exported
+		mark = -1 if self.watermark is None else self.watermark
+		write = exported & (ts > mark)	# hours after the watermark
+		days = aef.index.strftime('%Y-%m-%d')
+		for day in days.unique():
+			rows = (days == day) & exported
+			old = rows & (ts <= mark)
+			if old.any() and content_hash(values[old]) != self.days.get(day):	# values of exported hours changed, write the whole day
+				write |= rows
+			if rows.any():
+				self.days[day] = content_hash(values[rows])
+		self.watermark = max(mark, int(ts[exported].max()))
+		return write
+
+	def save(self):
+		with open(self.filename + '.tmp', 'w') as f:
+			json.dump({'watermark': self.watermark, 'days': self.days}, f)
+		os.replace(self.filename + '.tmp', self.filename)
+
+
+def content_hash(values):
+	return hashlib.sha256(np.ascontiguousarray(values).tobytes()).hexdigest()[:16]
@@ -12,7 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import requests
+from lib import client
+import gzip
+import os
+import queue
+import threading
+import time
 
 class InfluxDBWriter():
 	def __init__(self, database, host="http://localhost", port="8086"):
@@ -27,10 +32,9 @@ class InfluxDBWriter():
 		print("clearing database "+self.database)
 		payload = {'q':"DROP DATABASE "+self.database}
 		try:
-			requests.post(self.host + ':'+self.port + '/query', data=payload)
-		except:
-			print("Could not connect to database, is it running?")
-			quit()
+			client.post(self.host + ':'+self.port + '/query', data=payload)
+		except Exception as e:
+			raise ConnectionError("Could not connect to database, is it running?") from e
 
 		print("creating database " + self.database)
 		self.createDatabase()
@@ -40,10 +44,10 @@ class InfluxDBWriter():
 	def createDatabase(self):
 		payload = {'q': "CREATE DATABASE " + self.database}
 		try:
-			requests.post(self.host + ':' + self.port + '/query', data=payload)
-		except:
+			client.post(self.host + ':' + self.port + '/query', data=payload)
+		except Exception:
+			# Keep going, the writes fail as well and the batch writer keeps them until the database is back
 			print("Could not connect to database, is it running?")
-			quit()
 
 	def appendValue(self, measurement, tags, values, time, deltatime=0):
 		# create tags
@@ -60,8 +64,8 @@ class InfluxDBWriter():
 				valsstr += ","
 			valsstr += key+ "="+str(value)
 
-		# Check the time
-		timestr = str(int(time * 1000000000.0) + (deltatime*1000) )
+		# Check the time, the database is written with second precision
+		timestr = str(int(time + deltatime/1000000.0))
 
 		s = measurement + ","
 		s += tagstr + " "
@@ -71,16 +75,123 @@ class InfluxDBWriter():
 
 		self.data.append(s)
 
+	def appendLines(self, lines):
+		# Prepared line protocol, such as the lines of tools/influx_export.py
+		self.data.extend(lines)
+		self.writeData()
+
 	def appendValuePrepared(self, data, time):
-		timestr = str(int(time.timestamp())) + '000000000'
+		timestr = str(int(time.timestamp()))
 		self.data.append(data + " " + timestr)
 
 	def writeData(self,  force = False):
 		if len(self.data) > self.maxBuffer or force:
 			dataToSend = ("\n".join(self.data))
 			try:
-				requests.post(self.host+ ':'+self.port+ '/write?db='+self.database, data=dataToSend)
+				client.post(self.host+ ':'+self.port+ '/write?db='+self.database+ '&precision=s', data=dataToSend)
 			except:
 				print("Could not connect to database, is it running?")
 
 			self.data = []
+
+	def close(self):
+		self.writeData(True)
+
+
+class InfluxDBBatchWriter(InfluxDBWriter):
+	# Writes in a background thread, so the export overlaps with the calculation
+	def __init__(self, database, host="http://localhost", port="8086", spool='data/influx_spool.lp', maxBytes=4000000, maxAge=5.0, maxQueue=16):
+		InfluxDBWriter.__init__(self, database, host, port)
+		self.spool = spool			# lines that could not be written, sent again by the next writer
+		self.maxBytes = maxBytes	# uncompressed size of a request
+		self.maxAge = maxAge		# seconds lines may wait for a batch to fill up
+		self.queue = queue.Queue(maxQueue)	# bounded, so the calculation waits when the database falls behind
+		self.thread = None	# started with the first lines, so createDatabase() runs before the spool is replayed
+
+	def start(self):
+		if self.thread is None:
+			self.thread = threading.Thread(target=self.run, daemon=True)
+			self.thread.start()
+
+	def writeData(self,  force = False):
+		# Hand the buffered lines over to the background thread
+		if len(self.data) > 0 and (len(self.data) > self.maxBuffer or force):
+			self.start()
+			self.queue.put(self.data)
+			self.data = []
+
+	def close(self):
+		# Send the remaining lines and wait until everything is written or spooled
+		self.writeData(True)
+		self.start()
+		self.queue.put(None)
+		self.thread.join()
+
+	def run(self):
+		self.replay()
+		batch = []
+		size = 0
+		first = None
+		while True:
+			try:
+				timeout = None if first is None else max(0.0, first + self.maxAge - time.monotonic())
+				lines = self.queue.get(timeout=timeout)
+			except queue.Empty:
+				lines = []
+			if lines is None:
+				break
+			for line in lines:
+				line = line.rstrip('\n')
+				if first is None:
+					first = time.monotonic()
+				batch.append(line)
+				size += len(line) + 1
+				if size >= self.maxBytes:
+					self.send(batch)
+					batch, size, first = [], 0, None
+			if first is not None and time.monotonic() - first >= self.maxAge:
+				self.send(batch)
+				batch, size, first = [], 0, None
+		if len(batch) > 0:
+			self.send(batch)
+
+	def post(self, lines):
+		# Compressed request with second precision, retried with backoff by the shared client. Returns False if the lines should be kept
+		payload = gzip.compress(("\n".join(lines)).encode(), compresslevel=6)
+		try:
+			response = client.post(self.host+ ':'+self.port+ '/write', params={'db': self.database, 'precision': 's'}, data=payload, headers={'Content-Encoding': 'gzip'})
+		except Exception as e:
+			print("Could not connect to database, is it running? ("+e.__class__.__name__+")")
+			return False
+		if response.status_code == 400:
+			# The database rejected (part of) the data itself, sending it again would not help
+			print("Database rejected the data: "+response.text)
+			return True
+		if response.status_code >= 300:
+			# For example 404 when the database does not exist (yet) after an outage, keep the lines until it does
+			print("Database returned "+str(response.status_code)+": "+response.text)
+			return False
+		return True
+
+	def send(self, lines):
+		if not self.post(lines):
+			print("Spooling "+str(len(lines))+" lines to "+self.spool)
+			os.makedirs(os.path.dirname(self.spool) or '.', exist_ok=True)
+			with open(self.spool, 'a') as f:
+				f.write("\n".join(lines) + "\n")
+
+	def replay(self):
+		# Send the lines spooled by an earlier writer, the lines that still fail stay in the spool
+		if not os.path.exists(self.spool):
+			return
+		with open(self.spool) as f:
+			lines = [line for line in f.read().split("\n") if line != '']
+		print("Replaying "+str(len(lines))+" spooled lines")
+		n = max(1, self.maxBytes // 100)
+		for i in range(0, len(lines), n):
+			if not self.post(lines[i:i+n]):
+				with open(self.spool + '.tmp', 'w') as f:
+					f.write("\n".join(lines[i:]) + "\n")
+				os.replace(self.spool + '.tmp', self.spool)
+				return
+		os.remove(self.spool)